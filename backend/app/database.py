@@ -1,111 +1,396 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy import Column, Integer, String, Text, DateTime, JSON
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker
+from sqlalchemy import Integer, String, Text, DateTime, JSON, LargeBinary, Index, ForeignKey, UniqueConstraint, event
+from sqlalchemy import select, insert, func, cast, literal, desc, text, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import DeclarativeBase, MappedAsDataclass, Mapped, mapped_column, relationship, validates, undefer_group
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from datetime import datetime
+import hashlib
+import math
+import orjson
+from typing import Any, Optional
 from app.config import get_settings
 
 settings = get_settings()
 
-Base = declarative_base()
+
+class Base(MappedAsDataclass, DeclarativeBase, kw_only=True, eq=False, repr=False):
+    """Declarative base: models are dataclasses with keyword-only constructors.
+    
+    eq/repr are left to object so identity semantics stay ORM-style and repr()
+    never touches deferred columns. eager_defaults fetches server-generated
+    values (timestamps) with RETURNING at flush instead of expiring them.
+    """
+    __mapper_args__ = {"eager_defaults": True}
+
+
+# JSONB on PostgreSQL (binary, GIN-indexable); plain JSON elsewhere (e.g. SQLite for local dev).
+# none_as_null keeps Python None as SQL NULL (dataclass __init__ always assigns defaults).
+JSONType = JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql")
+
+# Native text[] on PostgreSQL; JSON list elsewhere
+StringListType = JSON(none_as_null=True).with_variant(postgresql.ARRAY(String), "postgresql")
+
+
+def resume_digest(resume_text: str) -> str:
+    """SHA-256 hex digest used to deduplicate uploaded resumes"""
+    return hashlib.sha256(resume_text.encode()).hexdigest()
 
 
 # Database Models
+# Large JSON/Text payloads are deferred so list/lookup queries don't load them;
+# read paths that need them opt in with undefer()/undefer_group("content").
+# Frequently read summary fields are denormalized into plain columns, kept in
+# sync by @validates hooks whenever the source JSON is assigned.
+# Timestamps are timezone-aware and filled by the database (DEFAULT now()).
 class Candidate(Base):
     """Candidate/New Hire model"""
     __tablename__ = "candidates"
+    __table_args__ = (
+        Index(
+            "ix_candidates_resume_analysis",
+            "resume_analysis",
+            postgresql_using="gin",
+            postgresql_ops={"resume_analysis": "jsonb_path_ops"},
+        ).ddl_if(dialect="postgresql"),
+        # Skill containment lookups (skills @> ARRAY[...])
+        Index("ix_candidates_skills", "skills", postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
+    
+    id: Mapped[int] = mapped_column(primary_key=True, index=True, init=False)
+    name: Mapped[str] = mapped_column(String)
+    email: Mapped[Optional[str]] = mapped_column(String, unique=True, index=True, default=None)
+    resume_text: Mapped[Optional[str]] = mapped_column(Text, deferred=True, default=None)
+    resume_sha256: Mapped[Optional[str]] = mapped_column(String(64), unique=True, index=True, init=False)  # Dedup key
+    resume_analysis: Mapped[Optional[dict]] = mapped_column(JSONType, default=None)
+    # Typed copies of resume_analysis fields, extracted when the analysis is written
+    experience_level: Mapped[Optional[str]] = mapped_column(String(32), index=True, init=False)
+    skills: Mapped[Optional[list[str]]] = mapped_column(StringListType, init=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), init=False)
     
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, nullable=False)
-    email = Column(String, unique=True, index=True)
-    resume_text = Column(Text)
-    resume_analysis = Column(JSON)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    @validates("resume_text")
+    def _sync_resume_sha256(self, key, value):
+        self.resume_sha256 = resume_digest(value) if value is not None else None
+        return value
+    
+    @validates("resume_analysis")
+    def _sync_analysis_fields(self, key, value):
+        for column, extracted in analysis_fields(value).items():
+            setattr(self, column, extracted)
+        return value
+
+
+def analysis_fields(resume_analysis: Optional[dict]) -> dict:
+    """Typed Candidate columns derived from a resume analysis (for bulk writes,
+    which bypass the @validates hook)"""
+    if not isinstance(resume_analysis, dict):
+        return {"experience_level": None, "skills": None}
+    return {
+        "experience_level": (resume_analysis.get("experience_level") or "junior").lower(),
+        "skills": [str(skill) for skill in resume_analysis.get("skills") or []],
+    }
 
 
 class CodebaseConfig(Base):
     """Pre-configured codebase (e.g., RocksDB)"""
     __tablename__ = "codebase_configs"
     
-    id = Column(String, primary_key=True)  # e.g., "rocksdb"
-    name = Column(String, nullable=False)
-    repository_url = Column(String, nullable=False)
-    github_token = Column(String, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    id: Mapped[str] = mapped_column(String, primary_key=True)  # e.g., "rocksdb"
+    name: Mapped[str] = mapped_column(String)
+    repository_url: Mapped[str] = mapped_column(String)
+    github_token: Mapped[Optional[str]] = mapped_column(String, default=None)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), init=False)
+
+
+# CodebaseAnalysis statuses
+ANALYSIS_PENDING = "pending"
+ANALYSIS_RUNNING = "running"
+ANALYSIS_COMPLETE = "complete"
+ANALYSIS_FAILED = "failed"
 
 
 class CodebaseAnalysis(Base):
-    """Stored codebase analysis results (from daily job)"""
+    """Stored codebase analysis results (from daily job).
+    
+    Rows are queued as pending and claimed by workers with
+    SELECT ... FOR UPDATE SKIP LOCKED; readers only see complete rows.
+    """
     __tablename__ = "codebase_analyses"
+    __table_args__ = (
+        # Latest analysis per codebase
+        Index("ix_codebase_analyses_codebase_analyzed", "codebase_id", desc("analyzed_at")),
+        # Small partial index for the worker claim query
+        Index(
+            "ix_codebase_analyses_pending",
+            "codebase_id",
+            postgresql_where=text("status = 'pending'"),
+            sqlite_where=text("status = 'pending'"),
+        ),
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
-    codebase_id = Column(String, index=True)
-    analysis_data = Column(JSON)
-    analyzed_at = Column(DateTime, default=datetime.utcnow)
+    id: Mapped[int] = mapped_column(primary_key=True, index=True, init=False)
+    codebase_id: Mapped[Optional[str]] = mapped_column(String)
+    status: Mapped[str] = mapped_column(String(16), default=ANALYSIS_PENDING, index=True)
+    analysis_data: Mapped[Optional[dict]] = mapped_column(JSONType, deferred=True, default=None)
+    analyzed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), init=False)
 
 
 class LearningPlan(Base):
     """4-week personalized learning plan"""
     __tablename__ = "learning_plans"
+    __table_args__ = (
+        # Latest plan per candidate (backward index scan, no sort)
+        Index("ix_learning_plans_candidate_created", "candidate_id", desc("created_at")),
+    )
+    
+    id: Mapped[int] = mapped_column(primary_key=True, index=True, init=False)
+    candidate_id: Mapped[Optional[int]] = mapped_column(Integer)
+    codebase_id: Mapped[Optional[str]] = mapped_column(String)
+    plan_data: Mapped[Optional[dict]] = mapped_column(JSONType, deferred=True, default=None)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), init=False)
     
-    id = Column(Integer, primary_key=True, index=True)
-    candidate_id = Column(Integer, index=True)
-    codebase_id = Column(String)
-    plan_data = Column(JSON)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # Never lazy-loaded (no implicit IO under asyncio); fetch with joinedload/selectinload
+    weekly_contents: Mapped[list["WeeklyContent"]] = relationship(
+        order_by="WeeklyContent.week_number", lazy="raise", init=False
+    )
+
+
+def reading_chapter_count(reading: Optional[dict]) -> int:
+    """Chapters in a week's reading: every four H2 sections make one (at least one)"""
+    sections = ((reading or {}).get("content") or "").count("## ")
+    return max(1, math.ceil(sections / 4))
 
 
 class WeeklyContent(Base):
     """Weekly learning content"""
     __tablename__ = "weekly_content"
+    __table_args__ = (
+        Index("ix_weekly_content_plan_week", "learning_plan_id", "week_number", unique=True),
+    )
+    
+    id: Mapped[int] = mapped_column(primary_key=True, index=True, init=False)
+    learning_plan_id: Mapped[Optional[int]] = mapped_column(ForeignKey("learning_plans.id", ondelete="CASCADE"))
+    week_number: Mapped[Optional[int]] = mapped_column(Integer)
+    reading_material: Mapped[Optional[dict]] = mapped_column(
+        JSONType, deferred=True, deferred_group="content", default=None
+    )
+    coding_tasks: Mapped[Optional[list]] = mapped_column(
+        JSONType, deferred=True, deferred_group="content", default=None
+    )
+    quiz: Mapped[Optional[list]] = mapped_column(JSONType, deferred=True, deferred_group="content", default=None)
+    task_count: Mapped[Optional[int]] = mapped_column(Integer, init=False)  # len(coding_tasks)
+    quiz_max_score: Mapped[Optional[int]] = mapped_column(Integer, init=False)  # len(quiz)
+    chapter_count: Mapped[Optional[int]] = mapped_column(Integer, init=False)  # reading_chapter_count(reading_material)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), init=False)
+    # Bumped on every content change; the week endpoint derives its ETag from it
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), init=False
+    )
+    
+    @validates("reading_material")
+    def _sync_chapter_count(self, key, value):
+        self.chapter_count = reading_chapter_count(value)
+        return value
     
-    id = Column(Integer, primary_key=True, index=True)
-    learning_plan_id = Column(Integer, index=True)
-    week_number = Column(Integer)
-    reading_material = Column(JSON)
-    coding_tasks = Column(JSON)
-    quiz = Column(JSON)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    @validates("coding_tasks")
+    def _sync_task_count(self, key, value):
+        self.task_count = len(value or [])
+        return value
+    
+    @validates("quiz")
+    def _sync_quiz_max_score(self, key, value):
+        self.quiz_max_score = len(value or [])
+        return value
 
 
 class MasterPlan(Base):
     """Pre-generated comprehensive master plan for a codebase"""
     __tablename__ = "master_plans"
+    __table_args__ = (
+        # Latest version per codebase
+        Index("ix_master_plans_codebase_version", "codebase_id", desc("version")),
+    )
     
-    id = Column(String, primary_key=True)  # e.g., "rocksdb_v1"
-    codebase_id = Column(String, index=True)
-    version = Column(Integer, default=1)
-    plan_overview = Column(Text)
+    id: Mapped[str] = mapped_column(String, primary_key=True)  # e.g., "rocksdb_v1"
+    codebase_id: Mapped[Optional[str]] = mapped_column(String)
+    version: Mapped[Optional[int]] = mapped_column(Integer, default=1)
+    plan_overview: Mapped[Optional[str]] = mapped_column(Text, default=None)
     # Full 4-week plan with all reading, tasks, and quizzes
-    weeks_data = Column(JSON)
-    generated_at = Column(DateTime, default=datetime.utcnow)
+    weeks_data: Mapped[Optional[list]] = mapped_column(JSONType, deferred=True, default=None)
+    week_count: Mapped[Optional[int]] = mapped_column(Integer, init=False)  # len(weeks_data)
+    generated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), init=False)
+    
+    @validates("weeks_data")
+    def _sync_week_count(self, key, value):
+        self.week_count = len(value or [])
+        return value
+
+
+
+# MasterPlanJob statuses
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
 
 
+class MasterPlanJob(Base):
+    """A background master plan generation requested through the API"""
+    __tablename__ = "master_plan_jobs"
+    
+    id: Mapped[int] = mapped_column(primary_key=True, init=False)
+    codebase_id: Mapped[str] = mapped_column(String, index=True)
+    status: Mapped[str] = mapped_column(String(16), default=JOB_PENDING)
+    result_id: Mapped[Optional[str]] = mapped_column(String, default=None)  # MasterPlan.id once done
+    error: Mapped[Optional[str]] = mapped_column(Text, default=None)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), init=False)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), default=None)
+
 
 class Progress(Base):
     """Track candidate progress"""
     __tablename__ = "progress"
+    __table_args__ = (
+        # One row per candidate/week; INCLUDE makes quiz score reads index-only on PostgreSQL
+        Index(
+            "ix_progress_candidate_week",
+            "candidate_id",
+            "week_number",
+            unique=True,
+            postgresql_include=["quiz_score"],
+        ),
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
-    candidate_id = Column(Integer, index=True)
-    week_number = Column(Integer)
-    reading_completed = Column(JSON, default=[])  # Array of completed chapter numbers
-    tasks_completed = Column(JSON, default=[])
-    quiz_score = Column(Integer, nullable=True)
-    quiz_answers = Column(JSON, nullable=True)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-
-
-# Create async engine
-engine = create_async_engine(
-    settings.database_url,
-    echo=settings.debug,
-    future=True
-)
+    id: Mapped[int] = mapped_column(primary_key=True, index=True, init=False)
+    candidate_id: Mapped[Optional[int]] = mapped_column(Integer)
+    week_number: Mapped[Optional[int]] = mapped_column(Integer)
+    quiz_score: Mapped[Optional[int]] = mapped_column(Integer, default=None)
+    quiz_answers: Mapped[Optional[Any]] = mapped_column(JSONType, default=None)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), init=False
+    )
+
+
+# ProgressItem kinds
+PROGRESS_READING = "reading"
+PROGRESS_TASK = "task"
+
+
+class ProgressItem(Base):
+    """A completed reading chapter or coding task for a week's progress"""
+    __tablename__ = "progress_items"
+    __table_args__ = (
+        UniqueConstraint("progress_id", "kind", "item_id", name="uq_progress_items_progress_kind_item"),
+    )
+    
+    id: Mapped[int] = mapped_column(primary_key=True, init=False)
+    progress_id: Mapped[int] = mapped_column(ForeignKey("progress.id", ondelete="CASCADE"), index=True)
+    kind: Mapped[str] = mapped_column(String(16))  # PROGRESS_READING or PROGRESS_TASK
+    item_id: Mapped[str] = mapped_column(String)  # Chapter number or task id
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), init=False)
+
+
+class GrokResponseCache(Base):
+    """Grok completions keyed by a hash of (model, temperature, messages)"""
+    __tablename__ = "grok_response_cache"
+    
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)  # sha256 hex digest
+    payload: Mapped[str] = mapped_column(Text)  # Raw completion text
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), init=False)
+
+
+class GrokSemanticCache(Base):
+    """Grok completions looked up by similarity of their input text"""
+    __tablename__ = "grok_semantic_cache"
+    
+    id: Mapped[int] = mapped_column(primary_key=True, init=False)
+    scope: Mapped[str] = mapped_column(String(32), index=True)  # Call site, e.g. "resume"
+    embedding: Mapped[bytes] = mapped_column(LargeBinary)  # Unit-length float32 vector
+    payload: Mapped[str] = mapped_column(Text)  # Raw completion text
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), init=False)
+
+
+def _engine_options(database_url: str) -> dict:
+    """Connection pool settings for the configured database"""
+    if database_url.startswith("sqlite"):
+        # aiosqlite defaults to NullPool (new connection + thread per checkout); reuse connections instead
+        return {"poolclass": AsyncAdaptedQueuePool, "pool_size": settings.db_pool_size}
+    
+    options = {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_pre_ping": settings.db_pre_ping,
+    }
+    
+    if "+asyncpg" in database_url:
+        options["connect_args"] = {
+            # Keep server-side prepared statements per connection so repeated queries skip parse/plan
+            "prepared_statement_cache_size": settings.db_statement_cache_size,
+            "server_settings": {
+                # Our queries are short OLTP lookups; JIT compilation only adds latency
+                "jit": "off",
+                "application_name": settings.app_name,
+            },
+        }
+    
+    return options
+
+
+def _json_serializer(value) -> str:
+    """orjson-backed JSON column serializer (much faster than stdlib json on large plans)"""
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets readers run alongside a writer; NORMAL sync drops the fsync per commit"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+_engine: Optional[AsyncEngine] = None
+
+
+def get_engine() -> AsyncEngine:
+    """Create the async engine on first use.
+    
+    Deferred so importing the models doesn't load the DB driver or build the
+    pool; the app creates it during startup (init_db).
+    """
+    global _engine
+    if _engine is None:
+        # The JSON (de)serializers also back asyncpg's json/jsonb type codecs, which
+        # SQLAlchemy registers on every new connection.
+        _engine = create_async_engine(
+            settings.database_url,
+            echo=settings.debug,
+            future=True,
+            query_cache_size=settings.db_query_cache_size,
+            json_serializer=_json_serializer,
+            json_deserializer=orjson.loads,
+            **_engine_options(settings.database_url)
+        )
+        
+        if _engine.dialect.name == "sqlite":
+            event.listen(_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    
+    return _engine
+
+
+class _LazyEngineSession(AsyncSession):
+    """AsyncSession bound to the engine from get_engine() unless a bind is given"""
+    
+    def __init__(self, bind=None, **kwargs):
+        super().__init__(bind=bind or get_engine(), **kwargs)
+
 
 # Create async session factory
 AsyncSessionLocal = async_sessionmaker(
-    engine,
-    class_=AsyncSession,
+    class_=_LazyEngineSession,
     expire_on_commit=False,
     autocommit=False,
     autoflush=False,
@@ -114,14 +399,100 @@ AsyncSessionLocal = async_sessionmaker(
 
 async def init_db():
     """Initialize database tables"""
-    async with engine.begin() as conn:
+    async with get_engine().begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
 
+async def backfill_weekly_content_counts(batch_size: int = 500) -> int:
+    """Fill denormalized counts on weekly_content rows written before those columns existed.
+    
+    create_all adds no columns to existing tables, and rows inserted before the
+    counts were stored have them NULL; readers would otherwise fall back to
+    defaults that over-report progress. Idempotent; returns the rows updated.
+    """
+    updated = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            result = await db.execute(
+                select(WeeklyContent)
+                .options(undefer_group("content"))
+                .where(or_(
+                    WeeklyContent.chapter_count.is_(None),
+                    WeeklyContent.task_count.is_(None),
+                    WeeklyContent.quiz_max_score.is_(None),
+                ))
+                .limit(batch_size)
+            )
+            rows = result.scalars().all()
+            if not rows:
+                break
+            for row in rows:
+                row.chapter_count = reading_chapter_count(row.reading_material)
+                row.task_count = len(row.coding_tasks or [])
+                row.quiz_max_score = len(row.quiz or [])
+            await db.commit()
+            updated += len(rows)
+    return updated
+
+
+def is_postgresql(db: AsyncSession) -> bool:
+    """Whether a session is bound to a PostgreSQL database"""
+    return db.bind.dialect.name == "postgresql"
+
+
+def dialect_insert(db: AsyncSession):
+    """Return the dialect-specific insert() for a session (supports ON CONFLICT clauses)"""
+    if is_postgresql(db):
+        return postgresql.insert
+    return sqlite.insert
+
+
+async def bulk_insert(db: AsyncSession, model, rows: list) -> None:
+    """Insert many rows (dicts of column values) in one batched executemany.
+    
+    Bypasses ORM unit-of-work bookkeeping, so @validates hooks do not run;
+    callers must supply any denormalized columns themselves. Does not commit.
+    """
+    if rows:
+        await db.execute(insert(model), rows)
+
+
+async def fetch_jsonb_as_text(db: AsyncSession, stmt) -> Optional[str]:
+    """Return the first JSON column selected by ``stmt`` as raw JSON text.
+    
+    The stored document is passed through undecoded (works on any dialect), so
+    callers can return it as a Response body. It is not re-validated by
+    Pydantic; only use it for blobs that were validated when written.
+    """
+    column = stmt.selected_columns[0]
+    result = await db.execute(stmt.with_only_columns(cast(column, Text)))
+    return result.scalar_one_or_none()
+
+
+# PostgreSQL-only: serialize query results to JSON text inside the database, so read
+# endpoints can return the document as-is instead of hydrating ORM objects and
+# re-encoding large JSONB columns in Python. Column labels become the JSON keys.
+
+async def fetch_json_object(db: AsyncSession, stmt) -> str:
+    """Return the first row of ``stmt`` as a JSON object string ("null" if no rows)"""
+    row = stmt.limit(1).subquery()
+    result = await db.execute(select(cast(func.row_to_json(row.table_valued()), Text)))
+    return result.scalar_one_or_none() or "null"
+
+
+async def fetch_json_array(db: AsyncSession, stmt) -> str:
+    """Return all rows of ``stmt`` as a JSON array string"""
+    rows = stmt.subquery()
+    agg = func.coalesce(func.json_agg(rows.table_valued()), cast(literal("[]"), postgresql.JSON))
+    result = await db.execute(select(cast(agg, Text)))
+    return result.scalar_one()
+
+
 async def get_db():
-    """Dependency for getting database sessions"""
+    """Dependency for getting database sessions.
+    
+    FastAPI caches dependencies per request, so every Depends(get_db) in one
+    request shares this session; the context manager closes it afterwards.
+    """
     async with AsyncSessionLocal() as session:
-        try:
-            yield session
-        finally:
-            await session.close()
+        yield session
@@ -1,26 +1,73 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, UploadFile, File, Response
+from fastapi.responses import FileResponse, ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
-from typing import List, Optional
-from datetime import datetime
-import PyPDF2
-import io
+from sqlalchemy import select, desc, delete, func, bindparam, and_
+from typing import BinaryIO, List, Optional
+from datetime import datetime, timedelta, timezone
 import asyncio
-from pathlib import Path
-import copy
+import time
+import traceback
+import pymupdf
+from sqlalchemy.orm import undefer, selectinload, Load
 from sqlalchemy.orm.attributes import flag_modified
 
-from app.database import get_db, Candidate, CodebaseConfig, CodebaseAnalysis, LearningPlan, WeeklyContent, Progress, MasterPlan
+from app.database import (
+    get_db, dialect_insert, bulk_insert, resume_digest, is_postgresql,
+    fetch_json_object, fetch_json_array, fetch_jsonb_as_text, reading_chapter_count,
+    Candidate, CodebaseConfig, CodebaseAnalysis, LearningPlan, WeeklyContent, Progress, ProgressItem, MasterPlan,
+    MasterPlanJob, PROGRESS_READING, PROGRESS_TASK, ANALYSIS_COMPLETE, JOB_PENDING, JOB_RUNNING
+)
 from app.schema import (
     CandidateCreate, CandidateResponse, LearningPlanCreate, LearningPlanResponse,
     WeeklyContentResponse, ProgressUpdate
 )
-from app.services.grok_service import grok_service
+from app.services.grok_service import grok_service, codebase_context, get_expectation_prompt
 from app.services.codebase_analyzer import codebase_analyzer
+from app.services.file_service import file_service
+from app.services.plan_template_service import plan_template_service
 
 router = APIRouter(prefix="/api", tags=["api"])
 
 
+# Read endpoints project just the plan columns they return (no ORM instances)
+_PLAN_COLUMNS = (
+    LearningPlan.id, LearningPlan.candidate_id, LearningPlan.codebase_id,
+    LearningPlan.plan_data, LearningPlan.created_at
+)
+
+
+def _weekly_content_row(learning_plan_id: int, week_number: int, reading, tasks, quiz) -> dict:
+    """Column values for a bulk WeeklyContent insert (including the denormalized counts)"""
+    return {
+        "learning_plan_id": learning_plan_id,
+        "week_number": week_number,
+        "reading_material": reading,
+        "coding_tasks": tasks,
+        "quiz": quiz,
+        "chapter_count": reading_chapter_count(reading),
+        "task_count": len(tasks or []),
+        "quiz_max_score": len(quiz or []),
+    }
+
+
+MAX_RESUME_BYTES = 10 * 1024 * 1024
+
+# Caps how many weeks are generated against Grok at once (shared across requests)
+MAX_CONCURRENT_WEEK_GENERATIONS = 4
+_WEEK_GENERATION_SLOTS = asyncio.Semaphore(MAX_CONCURRENT_WEEK_GENERATIONS)
+
+
+def _extract_pdf_text(upload: BinaryIO) -> str:
+    """Extract plain text from an uploaded PDF (PyMuPDF's C extractor).
+    
+    Reads straight from the upload's spooled temp file in the worker thread, so
+    the bytes are never copied through the event loop.
+    """
+    upload.seek(0)
+    with pymupdf.open(stream=upload.read(), filetype="pdf") as doc:
+        return "\n".join(page.get_text("text") for page in doc)
+
+
 @router.post("/upload-resume", response_model=CandidateResponse)
 async def upload_resume(
     file: UploadFile = File(...),
@@ -29,7 +76,6 @@ async def upload_resume(
     db: AsyncSession = Depends(get_db)
 ):
     """Upload resume - analysis happens in background"""
-    import time
     start_time = time.time()
     
     # Extract name from filename if not provided (e.g., "elon_musk.pdf" -> "Elon Musk")
@@ -40,65 +86,72 @@ async def upload_resume(
         extracted_name = filename_without_ext.replace('_', ' ').replace('-', ' ').title()
         name = extracted_name
     
+    if file.size is not None and file.size > MAX_RESUME_BYTES:
+        raise HTTPException(status_code=413, detail="Resume PDF is too large (max 10 MB)")
+    
     # Extract text from PDF
     try:
         print(f"📄 Reading PDF file: {file.filename}")
-        contents = await file.read()
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(contents))
-        resume_text = ""
-        for page in pdf_reader.pages:
-            resume_text += page.extract_text()
+        # Reading and text extraction are blocking/CPU-bound; keep them off the event loop
+        resume_text = await asyncio.to_thread(_extract_pdf_text, file.file)
         read_time = time.time() - start_time
         print(f"✓ PDF read successfully ({len(resume_text)} chars) in {read_time:.2f}s")
     except Exception as e:
         print(f"❌ Failed to read PDF: {str(e)}")
         raise HTTPException(status_code=400, detail=f"Failed to read PDF: {str(e)}")
     
-    # Check if we've already processed this exact resume (cache based on resume text)
-    result = await db.execute(
-        select(Candidate).where(Candidate.resume_text == resume_text).limit(1)
-    )
-    existing_candidate = result.scalar_one_or_none()
-    
-    if existing_candidate:
-        # Return existing candidate (analysis may be pending or complete)
-        print(f"✨ Found existing candidate with same resume (ID: {existing_candidate.id})")
-        total_time = time.time() - start_time
-        print(f"✅ Resume upload completed in {total_time:.2f}s (cached)")
-        return existing_candidate
-    
-    # Create new candidate without analysis (analysis happens in background)
-    candidate = Candidate(
-        name=name or "Unknown",
-        email=email or f"{name.lower().replace(' ', '.')}@example.com" if name else f"candidate_{hash(resume_text[:100])}@example.com",
-        resume_text=resume_text,
-        resume_analysis=None  # Will be filled by background job
+    # Create the candidate, or return the existing one for an identical resume, in one
+    # atomic statement (no SELECT-then-INSERT race). The no-op DO UPDATE makes RETURNING
+    # yield the existing row on conflict. Analysis happens in the background job.
+    insert = dialect_insert(db)
+    stmt = (
+        insert(Candidate)
+        .values(
+            name=name or "Unknown",
+            email=email or f"{name.lower().replace(' ', '.')}@example.com" if name else f"candidate_{hash(resume_text[:100])}@example.com",
+            resume_text=resume_text,
+            resume_sha256=resume_digest(resume_text)
+        )
     )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Candidate.resume_sha256],
+        set_={"resume_sha256": stmt.excluded.resume_sha256}
+    ).returning(Candidate.id, Candidate.name, Candidate.email, Candidate.resume_analysis, Candidate.created_at)
     
-    db.add(candidate)
+    result = await db.execute(stmt)
+    candidate = result.one()
     await db.commit()
-    await db.refresh(candidate)
     
     total_time = time.time() - start_time
-    print(f"✅ Resume uploaded instantly in {total_time:.2f}s - analysis will happen in background")
+    print(f"✅ Resume upload completed in {total_time:.2f}s - analysis happens in background")
     print(f"   Candidate: {candidate.name} (ID: {candidate.id})")
     
     return candidate
 
 
 @router.get("/codebases")
-async def list_codebases(db: AsyncSession = Depends(get_db)):
-    """List all pre-configured codebases"""
-    result = await db.execute(select(CodebaseConfig))
-    codebases = result.scalars().all()
-    return codebases
+async def list_codebases(
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db)
+):
+    """List pre-configured codebases (paginated)"""
+    # Plain rows of just the listed columns; no ORM objects, never exposes github_token
+    result = await db.execute(
+        select(CodebaseConfig.id, CodebaseConfig.name, CodebaseConfig.repository_url, CodebaseConfig.created_at)
+        .order_by(CodebaseConfig.id)
+        .limit(limit)
+        .offset(offset)
+    )
+    return result.mappings().all()
 
 
-@router.post("/codebases")
+@router.post("/codebases", status_code=202)
 async def add_codebase(
     codebase_id: str,
     name: str,
     repository_url: str,
+    background_tasks: BackgroundTasks,
     github_token: str = None,
     db: AsyncSession = Depends(get_db)
 ):
@@ -113,34 +166,38 @@ async def add_codebase(
     db.add(codebase)
     await db.commit()
     
-    # Trigger immediate analysis
-    await codebase_analyzer.analyze_configured_codebase(codebase_id)
+    # Analyze after the response is sent; poll /codebase-analysis/{codebase_id} for the result
+    background_tasks.add_task(codebase_analyzer.analyze_configured_codebase, codebase_id)
     
     return {'message': 'Codebase added and analysis started', 'codebase_id': codebase_id}
 
 
-@router.post("/analyze-codebase/{codebase_id}")
-async def trigger_analysis(codebase_id: str):
-    """Manually trigger codebase analysis"""
-    await codebase_analyzer.analyze_configured_codebase(codebase_id)
+@router.post("/analyze-codebase/{codebase_id}", status_code=202)
+async def trigger_analysis(codebase_id: str, background_tasks: BackgroundTasks):
+    """Manually trigger codebase analysis (runs in the background)"""
+    background_tasks.add_task(codebase_analyzer.analyze_configured_codebase, codebase_id)
     return {'message': 'Analysis triggered', 'codebase_id': codebase_id}
 
 
 @router.get("/codebase-analysis/{codebase_id}")
 async def get_codebase_analysis(codebase_id: str, db: AsyncSession = Depends(get_db)):
     """Get latest codebase analysis"""
-    result = await db.execute(
-        select(CodebaseAnalysis)
-        .where(CodebaseAnalysis.codebase_id == codebase_id)
+    # Stream the stored JSON straight through instead of decoding and re-encoding it
+    analysis_json = await fetch_jsonb_as_text(
+        db,
+        select(CodebaseAnalysis.analysis_data)
+        .where(
+            CodebaseAnalysis.codebase_id == codebase_id,
+            CodebaseAnalysis.status == ANALYSIS_COMPLETE
+        )
         .order_by(desc(CodebaseAnalysis.analyzed_at))
         .limit(1)
     )
-    analysis = result.scalar_one_or_none()
     
-    if not analysis:
+    if analysis_json is None:
         raise HTTPException(status_code=404, detail="Analysis not found")
     
-    return analysis.analysis_data
+    return Response(content=analysis_json, media_type="application/json")
 
 
 @router.post("/generate-plan", response_model=LearningPlanResponse)
@@ -149,7 +206,6 @@ async def generate_learning_plan(request: LearningPlanCreate, db: AsyncSession =
     Generate personalized 4-week learning plan FAST using pre-generated templates.
     This is 10x faster than the old approach!
     """
-    from app.services.plan_template_service import plan_template_service
     
     # Get candidate
     result = await db.execute(select(Candidate).where(Candidate.id == request.candidate_id))
@@ -164,36 +220,23 @@ async def generate_learning_plan(request: LearningPlanCreate, db: AsyncSession =
     # Check for existing learning plan (cache) unless force_regenerate is True
     if not request.force_regenerate:
         result = await db.execute(
-            select(LearningPlan).where(
+            select(*_PLAN_COLUMNS).where(
                 LearningPlan.candidate_id == request.candidate_id,
                 LearningPlan.codebase_id == request.codebase_url
             ).order_by(desc(LearningPlan.created_at)).limit(1)
         )
-        existing_plan = result.scalar_one_or_none()
+        existing_plan = result.mappings().first()
         
         # Return cached plan if it exists and is recent (within 7 days)
         if existing_plan:
-            from datetime import timedelta
-            age = datetime.utcnow() - existing_plan.created_at
+            created_at = existing_plan["created_at"]
+            if created_at.tzinfo is None:  # SQLite returns naive UTC timestamps
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            age = datetime.now(timezone.utc) - created_at
             if age < timedelta(days=7):
                 print(f"✨ Reusing existing learning plan (created {age.days} days ago)")
                 
-                response = LearningPlanResponse(
-                    id=existing_plan.id,
-                    candidate_id=existing_plan.candidate_id,
-                    codebase_url=existing_plan.codebase_id,
-                    weeks=[
-                        {
-                            "week_number": w["week_number"],
-                            "title": w["title"],
-                            "objectives": w.get("objectives", []),
-                            "topics": w.get("topics", [])
-                        }
-                        for w in existing_plan.plan_data.get("weeks", [])
-                    ],
-                    created_at=existing_plan.created_at
-                )
-                return response
+                return LearningPlanResponse.model_validate(existing_plan)
             else:
                 print(f"⚠️  Existing plan is {age.days} days old, regenerating...")
     else:
@@ -201,7 +244,7 @@ async def generate_learning_plan(request: LearningPlanCreate, db: AsyncSession =
     
     try:
         # FAST PATH: Use pre-generated master plan
-        master_plan = await plan_template_service.get_master_plan(request.codebase_url, db)
+        master_plan = await plan_template_service.get_master_plan_cached(request.codebase_url, db)
         
         if master_plan:
             print(f"✨ Using pre-generated master plan for {request.codebase_url}")
@@ -213,76 +256,53 @@ async def generate_learning_plan(request: LearningPlanCreate, db: AsyncSession =
             )
             
             # Create learning plan record
+            plan_data = {
+                "overview": personalized["overview"],
+                "recommendations": personalized.get("recommendations", []),
+                "weeks": [
+                    {
+                        "week_number": w["week_number"],
+                        "title": w["title"],
+                        "objectives": w.get("objectives", []),
+                        "topics": w.get("topics", []),
+                        "focus_areas": w.get("focus_areas", [])
+                    }
+                    for w in personalized["weeks"]
+                ]
+            }
             learning_plan = LearningPlan(
                 candidate_id=candidate.id,
                 codebase_id=request.codebase_url,
-                plan_data={
-                    "overview": personalized["overview"],
-                    "recommendations": personalized.get("recommendations", []),
-                    "weeks": [
-                        {
-                            "week_number": w["week_number"],
-                            "title": w["title"],
-                            "objectives": w.get("objectives", []),
-                            "topics": w.get("topics", []),
-                            "focus_areas": w.get("focus_areas", [])
-                        }
-                        for w in personalized["weeks"]
-                    ]
-                }
+                plan_data=plan_data
             )
             
             db.add(learning_plan)
-            await db.commit()
-            await db.refresh(learning_plan)
+            await db.flush()  # Assigns learning_plan.id
             
-            # Create weekly content from master plan
-            for week_data in personalized["weeks"]:
-                weekly_content = WeeklyContent(
-                    learning_plan_id=learning_plan.id,
-                    week_number=week_data["week_number"],
-                    reading_material=week_data.get("reading_material", {}),
-                    coding_tasks=week_data.get("coding_tasks", []),
-                    quiz=week_data.get("quiz", [])
+            # Create weekly content from master plan (one batched insert, same transaction)
+            await bulk_insert(db, WeeklyContent, [
+                _weekly_content_row(
+                    learning_plan.id,
+                    week_data["week_number"],
+                    week_data.get("reading_material", {}),
+                    week_data.get("coding_tasks", []),
+                    week_data.get("quiz", [])
                 )
-                db.add(weekly_content)
+                for week_data in personalized["weeks"]
+            ])
             
             await db.commit()
             
-            response = LearningPlanResponse(
-                id=learning_plan.id,
-                candidate_id=learning_plan.candidate_id,
-                codebase_url=learning_plan.codebase_id,
-                weeks=[
-                    {
-                        "week_number": w["week_number"],
-                        "title": w["title"],
-                        "objectives": w.get("objectives", []),
-                        "topics": w.get("topics", [])
-                    }
-                    for w in learning_plan.plan_data.get("weeks", [])
-                ],
-                created_at=learning_plan.created_at
-            )
-            
-            return response
+            return LearningPlanResponse.model_validate(learning_plan)
         
         else:
             print(f"⚠️  No master plan found for {request.codebase_url}, falling back to slow generation")
             
             # SLOW FALLBACK: Generate from scratch (old approach)
             # Get codebase analysis
-            result = await db.execute(
-                select(CodebaseAnalysis)
-                .where(CodebaseAnalysis.codebase_id == request.codebase_url)
-                .order_by(desc(CodebaseAnalysis.analyzed_at))
-                .limit(1)
-            )
-            analysis_record = result.scalar_one_or_none()
+            codebase_analysis = await codebase_analyzer.get_latest_analysis(request.codebase_url, db)
             
-            if analysis_record:
-                codebase_analysis = analysis_record.analysis_data
-            else:
+            if codebase_analysis is None:
                 codebase_analysis = await grok_service.analyze_codebase(
                     request.codebase_url,
                     request.github_token
@@ -294,56 +314,46 @@ async def generate_learning_plan(request: LearningPlanCreate, db: AsyncSession =
                 codebase_analysis
             )
             
-            learning_plan = LearningPlan(
-                candidate_id=candidate.id,
-                codebase_id=request.codebase_url,
-                plan_data=plan_data
-            )
-            
-            db.add(learning_plan)
-            await db.commit()
-            await db.refresh(learning_plan)
+            # Generate content for all 4 weeks concurrently, before any write: the
+            # Grok calls take minutes and must not hold a write transaction open
+            context = codebase_context(codebase_analysis)
             
-            # Generate content for all 4 weeks
-            for week in plan_data.get("weeks", []):
+            async def generate_week(week: dict) -> Optional[tuple]:
                 week_number = week["week_number"]
                 
                 try:
-                    reading = await grok_service.generate_weekly_reading(week, codebase_analysis)
-                    tasks = await grok_service.generate_coding_tasks(week, codebase_analysis)
-                    quiz = await grok_service.generate_quiz(week, reading.get("content", ""))
-                    
-                    weekly_content = WeeklyContent(
-                        learning_plan_id=learning_plan.id,
-                        week_number=week_number,
-                        reading_material=reading,
-                        coding_tasks=tasks,
-                        quiz=quiz
-                    )
+                    async with _WEEK_GENERATION_SLOTS:
+                        # Reading and tasks are independent; the quiz needs the reading
+                        reading, tasks = await asyncio.gather(
+                            grok_service.generate_weekly_reading(week, context),
+                            grok_service.generate_coding_tasks(week, context)
+                        )
+                        quiz = await grok_service.generate_quiz(week, reading.get("content", ""))
                     
-                    db.add(weekly_content)
+                    return week_number, reading, tasks, quiz
                 except Exception as e:
                     print(f"Warning: Failed to generate content for week {week_number}: {str(e)}")
+                    return None
             
-            await db.commit()
+            generated = await asyncio.gather(*(generate_week(w) for w in plan_data.get("weeks", [])))
             
-            response = LearningPlanResponse(
-                id=learning_plan.id,
-                candidate_id=learning_plan.candidate_id,
-                codebase_url=learning_plan.codebase_id,
-                weeks=[
-                    {
-                        "week_number": w["week_number"],
-                        "title": w["title"],
-                        "objectives": w["objectives"],
-                        "topics": w.get("topics", [])
-                    }
-                    for w in plan_data.get("weeks", [])
-                ],
-                created_at=learning_plan.created_at
+            learning_plan = LearningPlan(
+                candidate_id=candidate.id,
+                codebase_id=request.codebase_url,
+                plan_data=plan_data
             )
             
-            return response
+            db.add(learning_plan)
+            await db.flush()  # Assigns learning_plan.id
+            
+            await bulk_insert(db, WeeklyContent, [
+                _weekly_content_row(learning_plan.id, *week_content)
+                for week_content in generated
+                if week_content is not None
+            ])
+            await db.commit()
+            
+            return LearningPlanResponse.model_validate(learning_plan)
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Plan generation failed: {str(e)}")
@@ -354,62 +364,48 @@ async def generate_learning_plan(request: LearningPlanCreate, db: AsyncSession =
 async def get_learning_plan(candidate_id: int, db: AsyncSession = Depends(get_db)):
     """Get learning plan for a candidate"""
     result = await db.execute(
-        select(LearningPlan)
+        select(*_PLAN_COLUMNS)
         .where(LearningPlan.candidate_id == candidate_id)
         .order_by(desc(LearningPlan.created_at))
         .limit(1)
     )
-    learning_plan = result.scalar_one_or_none()
+    learning_plan = result.mappings().first()
     
     if not learning_plan:
         raise HTTPException(status_code=404, detail="Learning plan not found")
     
-    plan_data = learning_plan.plan_data
-    
-    response = LearningPlanResponse(
-        id=learning_plan.id,
-        candidate_id=learning_plan.candidate_id,
-        codebase_url=learning_plan.codebase_id,
-        weeks=[
-            {
-                "week_number": w["week_number"],
-                "title": w["title"],
-                "objectives": w["objectives"],
-                "topics": w.get("topics", [])
-            }
-            for w in plan_data.get("weeks", [])
-        ],
-        created_at=learning_plan.created_at
-    )
-    
-    return response
+    return LearningPlanResponse.model_validate(learning_plan)
 
 
 @router.get("/study-plan/{candidate_id}")
 async def get_study_plan(candidate_id: int, db: AsyncSession = Depends(get_db)):
     """Get complete study plan with all weekly content (similar to /api/master-plan/{codebase_id})"""
-    # Get learning plan
     result = await db.execute(
-        select(LearningPlan).where(LearningPlan.candidate_id == candidate_id).order_by(desc(LearningPlan.created_at)).limit(1)
+        select(*_PLAN_COLUMNS)
+        .where(LearningPlan.candidate_id == candidate_id)
+        .order_by(desc(LearningPlan.created_at))
+        .limit(1)
     )
-    learning_plan = result.scalar_one_or_none()
+    learning_plan = result.mappings().first()
     
     if not learning_plan:
         raise HTTPException(status_code=404, detail="No study plan found for this candidate")
     
-    # Get all weekly content
+    # Weekly content as a second projection (a join would repeat plan_data per week)
     result = await db.execute(
-        select(WeeklyContent).where(WeeklyContent.learning_plan_id == learning_plan.id).order_by(WeeklyContent.week_number)
+        select(
+            WeeklyContent.week_number, WeeklyContent.reading_material,
+            WeeklyContent.coding_tasks, WeeklyContent.quiz
+        ).where(WeeklyContent.learning_plan_id == learning_plan["id"])
     )
-    weekly_contents = result.scalars().all()
+    contents_by_week = {wc["week_number"]: wc for wc in result.mappings()}
+    plan_data = learning_plan["plan_data"]
     
     # Combine plan with weekly content
     weeks_data = []
-    for week in learning_plan.plan_data.get("weeks", []):
+    for week in plan_data.get("weeks", []):
         week_number = week["week_number"]
-        
-        # Find corresponding weekly content
-        weekly_content = next((wc for wc in weekly_contents if wc.week_number == week_number), None)
+        weekly_content = contents_by_week.get(week_number)
         
         week_data = {
             "week_number": week_number,
@@ -421,164 +417,169 @@ async def get_study_plan(candidate_id: int, db: AsyncSession = Depends(get_db)):
         
         if weekly_content:
             week_data.update({
-                "reading_material": weekly_content.reading_material,
-                "coding_tasks": weekly_content.coding_tasks,
-                "quiz": weekly_content.quiz
+                "reading_material": weekly_content["reading_material"],
+                "coding_tasks": weekly_content["coding_tasks"],
+                "quiz": weekly_content["quiz"]
             })
         
         weeks_data.append(week_data)
     
     return {
-        "id": f"study_plan_{candidate_id}_{learning_plan.id}",
+        "id": f"study_plan_{candidate_id}_{learning_plan['id']}",
         "candidate_id": candidate_id,
-        "codebase_id": learning_plan.codebase_id,
-        "overview": learning_plan.plan_data.get("overview", ""),
-        "recommendations": learning_plan.plan_data.get("recommendations", []),
+        "codebase_id": learning_plan["codebase_id"],
+        "overview": plan_data.get("overview", ""),
+        "recommendations": plan_data.get("recommendations", []),
         "weeks": weeks_data,
-        "created_at": learning_plan.created_at.isoformat() if learning_plan.created_at else None
+        "created_at": learning_plan["created_at"].isoformat() if learning_plan["created_at"] else None
     }
 
 
 
 
+def _reasoning_item(task: dict) -> dict:
+    """Title/description of a coding task as passed to the reasoning prompt"""
+    return {"title": task.get("title", "Task"), "description": task.get("description", "")[:200]}
+
+
+WEEK_CACHE_CONTROL = "private, max-age=60"
+
+
+def _weekly_content_etag(weekly_content: WeeklyContent) -> str:
+    """Weak validator for a week's content: row id + last modification time"""
+    return f'W/"{weekly_content.id}-{int(weekly_content.updated_at.timestamp() * 1_000_000)}"'
+
+
+def _reasons_complete(reading: Optional[dict], tasks: Optional[list]) -> bool:
+    """Whether the reading and every task already carry a "why this matters" reason"""
+    return not (reading and not reading.get("reason")) and all(t.get("reason") for t in tasks or [])
+
+
+async def _ensure_reasoning(reading: Optional[dict], tasks: Optional[list], expectation_context: str) -> tuple:
+    """Generate missing reasons for the reading and tasks in place.
+    
+    Returns (reading, tasks, changed); callers flag_modified + commit when changed.
+    """
+    if _reasons_complete(reading, tasks):
+        return reading, tasks, False
+    
+    missing_reading = bool(reading) and not reading.get("reason")
+    missing_tasks = [t for t in tasks or [] if not t.get("reason")]
+    
+    print(f"  🧠 Generating reasoning ({int(missing_reading)} reading, {len(missing_tasks)} tasks)...")
+    reading_reason, task_reasons = await asyncio.gather(
+        grok_service.generate_reasoning(
+            expectation_context,
+            "reading material",
+            reading.get("title", "Weekly Reading"),
+            reading.get("content", "")[:200]
+        ) if missing_reading else asyncio.sleep(0),
+        grok_service.generate_reasoning_batch(
+            expectation_context,
+            "coding task",
+            [_reasoning_item(t) for t in missing_tasks]
+        ) if missing_tasks else asyncio.sleep(0, [])
+    )
+    
+    if missing_reading:
+        reading["reason"] = reading_reason
+    for task, reason in zip(missing_tasks, task_reasons):
+        task["reason"] = reason
+    
+    return reading, tasks, True
+
+
 @router.get("/week/{candidate_id}/{week_number}", response_model=WeeklyContentResponse)
 async def get_weekly_content(
     candidate_id: int,
     week_number: int,
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db)
 ):
     """Get weekly content (reading, tasks, quiz) - uses master plan or generates on-demand"""
-    # Get learning plan
+    # Get learning plan and this week's content in one query
     result = await db.execute(
-        select(LearningPlan)
+        select(LearningPlan.id, LearningPlan.codebase_id, WeeklyContent)
+        .outerjoin(
+            WeeklyContent,
+            and_(
+                WeeklyContent.learning_plan_id == LearningPlan.id,
+                WeeklyContent.week_number == week_number
+            )
+        )
+        .options(Load(WeeklyContent).undefer_group("content"))
         .where(LearningPlan.candidate_id == candidate_id)
         .order_by(desc(LearningPlan.created_at))
         .limit(1)
     )
-    learning_plan = result.scalar_one_or_none()
+    row = result.first()
     
-    if not learning_plan:
+    if not row:
         raise HTTPException(status_code=404, detail="Learning plan not found")
     
-    # Get weekly content
-    result = await db.execute(
-        select(WeeklyContent).where(
-            WeeklyContent.learning_plan_id == learning_plan.id,
-            WeeklyContent.week_number == week_number
-        ).limit(1)
-    )
-    weekly_content = result.scalars().first()
+    learning_plan_id, codebase_id, weekly_content = row
     
-    # Get candidate to determine expectations
-    result = await db.execute(select(Candidate).where(Candidate.id == candidate_id))
-    candidate = result.scalar_one_or_none()
+    # Get candidate's experience level to determine expectations
+    result = await db.execute(select(Candidate.experience_level).where(Candidate.id == candidate_id))
+    level = result.scalar_one_or_none()
     
-    expectation_context = None
-    if candidate and candidate.resume_analysis:
-        try:
-            level = candidate.resume_analysis.get("experience_level", "junior").lower()
-            if "senior" in level or "staff" in level or "lead" in level:
-                prompt_file = "senior_engineer_prompt.md"
-            else:
-                prompt_file = "junior_engineer_prompt.md"
-                
-            base_path = Path(__file__).parent.parent / "expectation_prompts"
-            prompt_path = base_path / prompt_file
-            
-            if prompt_path.exists():
-                with open(prompt_path, "r") as f:
-                    expectation_context = f.read()
-        except Exception as e:
-            print(f"Error loading expectation: {e}")
+    expectation_context = get_expectation_prompt(level) if level else None
+    
+    # An ETag is only ever handed out for content with all reasons filled in, and
+    # any change bumps updated_at, so a matching If-None-Match means the client's
+    # copy is current. Without an experience level reasons can't be generated yet,
+    # so nothing is cacheable until one is set.
+    cacheable = expectation_context is not None
+    if cacheable and weekly_content is not None and _reasons_complete(
+        weekly_content.reading_material, weekly_content.coding_tasks
+    ):
+        etag = _weekly_content_etag(weekly_content)
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": WEEK_CACHE_CONTROL})
 
     # If weekly content doesn't exist or is empty, try to get from master plan first
     if not weekly_content or not weekly_content.reading_material or not weekly_content.coding_tasks:
         print(f"📝 Getting weekly content for week {week_number}...")
         
         # Try to get from master plan (shared across all candidates for this codebase)
-        result = await db.execute(
-            select(MasterPlan)
-            .where(MasterPlan.codebase_id == learning_plan.codebase_id)
-            .order_by(desc(MasterPlan.version))
-            .limit(1)
-        )
-        master_plan = result.scalar_one_or_none()
+        master_plan = await plan_template_service.get_master_plan_cached(codebase_id, db)
         
-        if master_plan and master_plan.weeks_data:
+        if master_plan and master_plan["weeks"]:
             print(f"  ✅ Found master plan - copying content from master plan")
             # Find the week in master plan
             week_content = next(
-                (w for w in master_plan.weeks_data if w.get("week_number") == week_number),
+                (w for w in master_plan["weeks"] if w.get("week_number") == week_number),
                 None
             )
             
             if week_content:
-                # Copy content from master plan
-                reading = week_content.get("reading_material", {})
-                tasks = week_content.get("coding_tasks", [])
+                # Copy content from master plan (shallow copies: reasons are added per
+                # candidate and must not leak into the shared cached plan)
+                reading = dict(week_content.get("reading_material", {}))
+                tasks = [dict(t) for t in week_content.get("coding_tasks", [])]
                 quiz = week_content.get("quiz", [])
-                
-                # If we have expectations, ensure we have reasons
-                if expectation_context:
-                    from app.services.grok_service import grok_service
-                    
-                    # Generate reasoning for reading if missing
-                    if reading and not reading.get("reason"):
-                        print("  🧠 Generating reasoning for reading material...")
-                        reading["reason"] = await grok_service.generate_reasoning(
-                            expectation_context, 
-                            "reading material", 
-                            reading.get("title", "Weekly Reading"), 
-                            reading.get("content", "")[:200]
-                        )
-                    
-                    # Generate reasoning for tasks if missing
-                    reasoning_tasks = []
-                    for task in tasks:
-                        if not task.get("reason"):
-                            reasoning_tasks.append(task)
-                    
-                    if reasoning_tasks:
-                        print(f"  🧠 Generating reasoning for {len(reasoning_tasks)} tasks...")
-                        # Process in parallel
-                        async def update_task_reason(t):
-                            t["reason"] = await grok_service.generate_reasoning(
-                                expectation_context,
-                                "coding task",
-                                t.get("title", "Task"),
-                                t.get("description", "")[:200]
-                            )
-                        
-                        await asyncio.gather(*[update_task_reason(t) for t in reasoning_tasks])
             else:
                 raise HTTPException(status_code=404, detail=f"Week {week_number} not found in master plan")
         else:
             print(f"  ⚠️  No master plan found - generating content on-demand")
             # Fallback: Generate on-demand (for when master plan doesn't exist yet)
-            weeks = learning_plan.plan_data.get("weeks", [])
+            result = await db.execute(select(LearningPlan.plan_data).where(LearningPlan.id == learning_plan_id))
+            weeks = (result.scalar_one() or {}).get("weeks", [])
             week_data = next((w for w in weeks if w.get("week_number") == week_number), None)
             
             if not week_data:
                 raise HTTPException(status_code=404, detail=f"Week {week_number} not found in learning plan")
             
             # Get codebase analysis for context
-            result = await db.execute(
-                select(CodebaseAnalysis)
-                .where(CodebaseAnalysis.codebase_id == learning_plan.codebase_id)
-                .order_by(desc(CodebaseAnalysis.analyzed_at))
-                .limit(1)
-            )
-            analysis_record = result.scalar_one_or_none()
-            codebase_analysis = analysis_record.analysis_data if analysis_record else {}
+            codebase_analysis = await codebase_analyzer.get_latest_analysis(codebase_id, db) or {}
             
             # Generate content using Grok
-            from app.services.grok_service import grok_service
-            
-            print(f"  📚 Generating reading material...")
-            reading = await grok_service.generate_weekly_reading(week_data, codebase_analysis, expectation_context)
-            
-            print(f"  💻 Generating coding tasks...")
-            tasks = await grok_service.generate_coding_tasks(week_data, codebase_analysis, expectation_context)
+            print(f"  📚💻 Generating reading material and coding tasks...")
+            reading, tasks = await asyncio.gather(
+                grok_service.generate_weekly_reading(week_data, codebase_analysis, expectation_context),
+                grok_service.generate_coding_tasks(week_data, codebase_analysis, expectation_context)
+            )
             
             print(f"  📝 Generating quiz...")
             quiz = await grok_service.generate_quiz(week_data, reading.get("content", ""))
@@ -589,83 +590,43 @@ async def get_weekly_content(
             weekly_content.coding_tasks = tasks
             weekly_content.quiz = quiz
         else:
-            weekly_content = WeeklyContent(
-                learning_plan_id=learning_plan.id,
-                week_number=week_number,
-                reading_material=reading,
-                coding_tasks=tasks,
-                quiz=quiz
+            # Concurrent first loads of a week both get here; the first insert wins
+            # and everyone continues with that row
+            insert = dialect_insert(db)
+            await db.execute(
+                insert(WeeklyContent)
+                .values(**_weekly_content_row(learning_plan_id, week_number, reading, tasks, quiz))
+                .on_conflict_do_nothing(index_elements=["learning_plan_id", "week_number"])
             )
-            db.add(weekly_content)
-        
-        await db.commit()
-        await db.refresh(weekly_content)
+            result = await db.execute(
+                select(WeeklyContent)
+                .options(Load(WeeklyContent).undefer_group("content"))
+                .where(WeeklyContent.learning_plan_id == learning_plan_id, WeeklyContent.week_number == week_number)
+            )
+            weekly_content = result.scalar_one()
         
-        print(f"✅ Weekly content saved for week {week_number}")
+        content_changed = True
+    else:
+        content_changed = False
     
-    # Backfill reasoning if missing (for existing content)
-    if weekly_content and expectation_context:
-        updated = False
-        reading = weekly_content.reading_material
-        tasks = weekly_content.coding_tasks
-        
-        # Check reading
-        if reading and not reading.get("reason"):
-            print("  🧠 Backfilling reasoning for reading material...")
-            from app.services.grok_service import grok_service
-            # Create a copy to ensure SQLAlchemy detects change
-            new_reading = copy.deepcopy(reading)
-            new_reading["reason"] = await grok_service.generate_reasoning(
-                expectation_context, 
-                "reading material", 
-                new_reading.get("title", "Weekly Reading"), 
-                new_reading.get("content", "")[:200]
-            )
-            weekly_content.reading_material = new_reading
+    # Fill in any missing "why this matters" reasons (fresh copies and older rows alike)
+    if expectation_context:
+        _, _, reasons_added = await _ensure_reasoning(
+            weekly_content.reading_material, weekly_content.coding_tasks, expectation_context
+        )
+        if reasons_added:
+            # Mutated in place; flag_modified tells SQLAlchemy the JSON changed
             flag_modified(weekly_content, "reading_material")
-            updated = True
-            
-        # Check tasks
-        if tasks:
-            tasks_updated = False
-            reasoning_tasks = []
-            
-            for i, task in enumerate(tasks):
-                if not task.get("reason"):
-                    reasoning_tasks.append((i, task))
-            
-            if reasoning_tasks:
-                print(f"  🧠 Backfilling reasoning for {len(reasoning_tasks)} tasks...")
-                from app.services.grok_service import grok_service
-                
-                # Create copy of tasks
-                new_tasks = copy.deepcopy(tasks)
-                
-                async def update_task_backfill(idx, t):
-                    t["reason"] = await grok_service.generate_reasoning(
-                        expectation_context,
-                        "coding task",
-                        t.get("title", "Task"),
-                        t.get("description", "")[:200]
-                    )
-                    return idx, t
-                
-                results = await asyncio.gather(*[update_task_backfill(i, new_tasks[i]) for i, _ in reasoning_tasks])
-                
-                # Update tasks list
-                for idx, t in results:
-                    new_tasks[idx] = t
-                    
-                weekly_content.coding_tasks = new_tasks
-                flag_modified(weekly_content, "coding_tasks")
-                updated = True
-
-        if updated:
-            db.add(weekly_content)
-            await db.commit()
-            await db.refresh(weekly_content)
-            print("  ✅ Reasoning backfilled")
+            flag_modified(weekly_content, "coding_tasks")
+            content_changed = True
+    
+    if content_changed:
+        await db.commit()
+        print(f"✅ Weekly content saved for week {week_number}")
 
+    if cacheable and _reasons_complete(weekly_content.reading_material, weekly_content.coding_tasks):
+        response.headers["ETag"] = _weekly_content_etag(weekly_content)
+        response.headers["Cache-Control"] = WEEK_CACHE_CONTROL
     return WeeklyContentResponse(
         week_number=weekly_content.week_number,
         reading_material=weekly_content.reading_material,
@@ -674,6 +635,73 @@ async def get_weekly_content(
     )
 
 
+# Hot progress statements are built once; values are bound per call, so each
+# execution is a straight compiled-cache hit
+_PROGRESS_FOR_WEEK = select(Progress).where(
+    Progress.candidate_id == bindparam("candidate_id"),
+    Progress.week_number == bindparam("week_number")
+)
+
+_COMPLETED_ITEM_IDS = (
+    select(ProgressItem.item_id)
+    .where(ProgressItem.progress_id == bindparam("progress_id"), ProgressItem.kind == bindparam("kind"))
+    .order_by(ProgressItem.id)
+)
+
+# Week progress plus its completed items in one round trip; the unique
+# (candidate_id, week_number) index makes the Progress side a single seek
+_WEEK_PROGRESS_WITH_ITEMS = (
+    select(Progress.id, Progress.quiz_score, Progress.quiz_answers, ProgressItem.kind, ProgressItem.item_id)
+    .outerjoin(ProgressItem, ProgressItem.progress_id == Progress.id)
+    .where(
+        Progress.candidate_id == bindparam("candidate_id"),
+        Progress.week_number == bindparam("week_number")
+    )
+    .order_by(ProgressItem.id)
+)
+
+
+async def _get_or_create_progress(db: AsyncSession, candidate_id: int, week_number: int) -> Progress:
+    """Get the progress record for a week, creating it if missing"""
+    params = {"candidate_id": candidate_id, "week_number": week_number}
+    result = await db.execute(_PROGRESS_FOR_WEEK, params)
+    progress = result.scalar_one_or_none()
+    
+    if not progress:
+        # Two first writes for a week can race (e.g. a progress update and a
+        # chapter completion); the unique index keeps one row and both use it
+        insert = dialect_insert(db)
+        await db.execute(
+            insert(Progress)
+            .values(candidate_id=candidate_id, week_number=week_number)
+            .on_conflict_do_nothing(index_elements=["candidate_id", "week_number"])
+        )
+        result = await db.execute(_PROGRESS_FOR_WEEK, params)
+        progress = result.scalar_one()
+    
+    return progress
+
+
+async def _mark_item_complete(db: AsyncSession, progress: Progress, kind: str, item_id) -> bool:
+    """Record a completed item; returns False if it was already completed"""
+    insert = dialect_insert(db)
+    result = await db.execute(
+        insert(ProgressItem)
+        .values(progress_id=progress.id, kind=kind, item_id=str(item_id))
+        .on_conflict_do_nothing()
+    )
+    return result.rowcount > 0
+
+
+async def _get_completed_items(db: AsyncSession, progress_id: int, kind: str) -> list:
+    """List completed item ids in completion order (chapters as ints, tasks as strings)"""
+    result = await db.execute(_COMPLETED_ITEM_IDS, {"progress_id": progress_id, "kind": kind})
+    items = result.scalars().all()
+    if kind == PROGRESS_READING:
+        return [int(item) for item in items]
+    return list(items)
+
+
 @router.post("/progress/{candidate_id}")
 async def update_progress(
     candidate_id: int,
@@ -682,36 +710,24 @@ async def update_progress(
 ):
     """Update candidate progress"""
     # Get or create progress record
-    result = await db.execute(
-        select(Progress).where(
-            Progress.candidate_id == candidate_id,
-            Progress.week_number == progress.week_number
-        )
-    )
-    progress_record = result.scalar_one_or_none()
-    
-    if not progress_record:
-        progress_record = Progress(
-            candidate_id=candidate_id,
-            week_number=progress.week_number
-        )
-        db.add(progress_record)
+    progress_record = await _get_or_create_progress(db, candidate_id, progress.week_number)
     
     # Update progress
-    if progress.reading_completed is not None:
-        progress_record.reading_completed = 1 if progress.reading_completed else 0
+    if progress.reading_completed is False:
+        # Reset reading progress (chapters are marked individually via the chapter endpoint)
+        await db.execute(
+            delete(ProgressItem).where(
+                ProgressItem.progress_id == progress_record.id,
+                ProgressItem.kind == PROGRESS_READING
+            )
+        )
     
     if progress.task_id is not None:
-        # Clone list to ensure change detection
-        tasks = list(progress_record.tasks_completed) if progress_record.tasks_completed else []
-        if progress.task_id not in tasks:
-            tasks.append(progress.task_id)
-            progress_record.tasks_completed = tasks
-            flag_modified(progress_record, "tasks_completed")
+        await _mark_item_complete(db, progress_record, PROGRESS_TASK, progress.task_id)
     
     if progress.quiz_answers is not None:
         progress_record.quiz_answers = progress.quiz_answers
-        progress_record.quiz_score = len([a for a in progress.quiz_answers if a is not None])
+        progress_record.quiz_score = sum(1 for a in progress.quiz_answers if a is not None)
         flag_modified(progress_record, "quiz_answers")
     
     await db.commit()
@@ -728,43 +744,17 @@ async def mark_chapter_complete(
 ):
     """Mark a chapter as complete"""
     # Get or create progress record
-    result = await db.execute(
-        select(Progress).where(
-            Progress.candidate_id == candidate_id,
-            Progress.week_number == week_number
-        )
-    )
-    progress = result.scalar_one_or_none()
+    progress = await _get_or_create_progress(db, candidate_id, week_number)
     
-    if not progress:
-        progress = Progress(
-            candidate_id=candidate_id,
-            week_number=week_number,
-            reading_completed=[]
-        )
-        db.add(progress)
-    
-    # Handle both old integer format and new JSON array format
-    if progress.reading_completed is None:
-        progress.reading_completed = []
-    elif isinstance(progress.reading_completed, int):
-        # Convert old integer format to array
-        progress.reading_completed = []
-    elif not isinstance(progress.reading_completed, list):
-        # Ensure it's a list
-        progress.reading_completed = []
-    
-    # Add chapter to completed list if not already there
-    if chapter_number not in progress.reading_completed:
-        progress.reading_completed.append(chapter_number)
-        flag_modified(progress, "reading_completed")
-        progress.updated_at = datetime.utcnow()
+    # Single-row insert; a chapter that is already complete is a no-op
+    if await _mark_item_complete(db, progress, PROGRESS_READING, chapter_number):
+        progress.updated_at = func.now()
     
     await db.commit()
     
     return {
         "message": "Chapter marked as complete",
-        "completed_chapters": progress.reading_completed
+        "completed_chapters": await _get_completed_items(db, progress.id, PROGRESS_READING)
     }
 
 
@@ -776,14 +766,12 @@ async def get_week_progress(
 ):
     """Get progress for a specific week including completed chapters"""
     result = await db.execute(
-        select(Progress).where(
-            Progress.candidate_id == candidate_id,
-            Progress.week_number == week_number
-        )
+        _WEEK_PROGRESS_WITH_ITEMS,
+        {"candidate_id": candidate_id, "week_number": week_number}
     )
-    progress = result.scalar_one_or_none()
+    rows = result.all()
     
-    if not progress:
+    if not rows:
         return {
             "candidate_id": candidate_id,
             "week_number": week_number,
@@ -795,26 +783,37 @@ async def get_week_progress(
     return {
         "candidate_id": candidate_id,
         "week_number": week_number,
-        "completed_chapters": progress.reading_completed or [],
-        "completed_tasks": progress.tasks_completed or [],
-        "quiz_score": progress.quiz_score,
-        "quiz_answers": progress.quiz_answers
+        "completed_chapters": [int(r.item_id) for r in rows if r.kind == PROGRESS_READING],
+        "completed_tasks": [r.item_id for r in rows if r.kind == PROGRESS_TASK],
+        "quiz_score": rows[0].quiz_score,
+        "quiz_answers": rows[0].quiz_answers
     }
 
 
 @router.get("/candidates", response_model=List[CandidateResponse])
 async def list_candidates(db: AsyncSession = Depends(get_db)):
     """List all candidates"""
-    result = await db.execute(select(Candidate))
-    candidates = result.scalars().all()
-    return candidates
+    stmt = select(
+        Candidate.id, Candidate.name, Candidate.email,
+        Candidate.resume_analysis, Candidate.created_at
+    ).order_by(Candidate.id)
+    
+    if is_postgresql(db):
+        return Response(content=await fetch_json_array(db, stmt), media_type="application/json")
+    
+    # Rows come straight from our own table; skip re-validating them through
+    # CandidateResponse (which stays as the documented schema)
+    result = await db.execute(stmt)
+    return ORJSONResponse([dict(row) for row in result.mappings()])
 
 
 @router.get("/candidate/{candidate_id}/status")
 async def get_candidate_status(candidate_id: int, db: AsyncSession = Depends(get_db)):
     """Check if candidate's resume analysis is complete"""
-    result = await db.execute(select(Candidate).where(Candidate.id == candidate_id))
-    candidate = result.scalar_one_or_none()
+    result = await db.execute(
+        select(Candidate.id, Candidate.name, Candidate.resume_analysis).where(Candidate.id == candidate_id)
+    )
+    candidate = result.one_or_none()
     
     if not candidate:
         raise HTTPException(status_code=404, detail="Candidate not found")
@@ -827,46 +826,125 @@ async def get_candidate_status(candidate_id: int, db: AsyncSession = Depends(get
     }
 
 
-@router.post("/generate-master-plan/{codebase_id}")
-async def generate_master_plan_endpoint(codebase_id: str, db: AsyncSession = Depends(get_db)):
+@router.post("/generate-master-plan/{codebase_id}", status_code=202)
+async def generate_master_plan_endpoint(
+    codebase_id: str,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db)
+):
     """
-    Generate comprehensive master plan template for a codebase.
+    Start generating a comprehensive master plan template for a codebase.
     This should be run once per codebase (admin only in production).
+    Generation takes many Grok calls, so it runs in the background; poll /jobs/{job_id}.
     """
-    from app.services.plan_template_service import plan_template_service
+    # One generation per codebase at a time: hand back the job already in flight
+    await plan_template_service.fail_abandoned_jobs(codebase_id, db)
+    result = await db.execute(
+        select(MasterPlanJob.id, MasterPlanJob.status)
+        .where(
+            MasterPlanJob.codebase_id == codebase_id,
+            MasterPlanJob.status.in_((JOB_PENDING, JOB_RUNNING))
+        )
+        .order_by(desc(MasterPlanJob.id))
+        .limit(1)
+    )
+    active = result.one_or_none()
+    if active:
+        await db.commit()
+        return {"job_id": active.id, "status": active.status}
     
-    try:
-        master_plan = await plan_template_service.generate_master_plan(codebase_id, db)
-        return {
-            "message": "Master plan generated successfully",
-            "plan_id": master_plan["id"],
-            "weeks_count": len(master_plan["weeks"])
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Master plan generation failed: {str(e)}")
+    job = MasterPlanJob(codebase_id=codebase_id)
+    db.add(job)
+    await db.commit()
+    
+    background_tasks.add_task(plan_template_service.run_master_plan_job, job.id, codebase_id)
+    
+    return {"job_id": job.id, "status": job.status}
+
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: int, db: AsyncSession = Depends(get_db)):
+    """Status of a master plan generation job"""
+    result = await db.execute(
+        select(
+            MasterPlanJob.id,
+            MasterPlanJob.codebase_id,
+            MasterPlanJob.status,
+            MasterPlanJob.result_id.label("plan_id"),
+            MasterPlanJob.error,
+            MasterPlanJob.created_at,
+            MasterPlanJob.finished_at,
+        ).where(MasterPlanJob.id == job_id)
+    )
+    job = result.mappings().one_or_none()
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return job
 
 
 @router.get("/master-plan/{codebase_id}")
 async def get_master_plan_endpoint(codebase_id: str, db: AsyncSession = Depends(get_db)):
     """Get the latest master plan for a codebase"""
-    from app.services.plan_template_service import plan_template_service
     
-    master_plan = await plan_template_service.get_master_plan(codebase_id, db)
+    if is_postgresql(db):
+        # Let Postgres emit the document directly; weeks_data can be large
+        stmt = (
+            select(
+                MasterPlan.id,
+                MasterPlan.codebase_id,
+                MasterPlan.version,
+                MasterPlan.plan_overview.label("overview"),
+                MasterPlan.weeks_data.label("weeks"),
+                MasterPlan.generated_at,
+            )
+            .where(MasterPlan.codebase_id == codebase_id)
+            .order_by(desc(MasterPlan.version))
+        )
+        return Response(content=await fetch_json_object(db, stmt), media_type="application/json")
     
-    return master_plan
+    return await plan_template_service.get_master_plan_cached(codebase_id, db)
+
+
+# Child directories whose listings are warmed after a directory is opened
+PREWARM_CHILD_DIRS = 10
+_PREWARM_SLOTS = asyncio.Semaphore(4)
+
+
+async def _prewarm_listings(codebase_id: str, paths: List[str]):
+    """Populate the listing cache for directories the user is likely to open next"""
+    
+    async def warm(path: str):
+        async with _PREWARM_SLOTS:
+            try:
+                await asyncio.to_thread(file_service.list_files, codebase_id, path)
+            except Exception:
+                pass  # Best effort; the real request will report any error
+    
+    await asyncio.gather(*(warm(p) for p in paths))
 
 
 @router.get("/codebase/{codebase_id}/files")
-async def get_codebase_files(codebase_id: str, path: str = "", db: AsyncSession = Depends(get_db)):
+async def get_codebase_files(
+    codebase_id: str,
+    background_tasks: BackgroundTasks,
+    path: str = "",
+    db: AsyncSession = Depends(get_db)
+):
     """List files in the codebase"""
-    from app.services.file_service import file_service
     
     # Ensure repo exists (lazy clone if needed)
     # We need to look up the URL from DB if we want to be 100% correct, 
     # but for optimization we can check if it exists first.
     
     try:
-        files = file_service.list_files(codebase_id, path)
+        files = await asyncio.to_thread(file_service.list_files, codebase_id, path)
+        
+        child_dirs = [f["path"] for f in files if f["type"] == "dir"][:PREWARM_CHILD_DIRS]
+        if child_dirs:
+            background_tasks.add_task(_prewarm_listings, codebase_id, child_dirs)
+        
         return {"files": files}
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid path")
@@ -874,33 +952,69 @@ async def get_codebase_files(codebase_id: str, path: str = "", db: AsyncSession
         raise HTTPException(status_code=500, detail=str(e))
 
 
+FILE_CACHE_CONTROL = "private, max-age=60"
+
+
 @router.get("/codebase/{codebase_id}/content")
-async def get_file_content(codebase_id: str, path: str, db: AsyncSession = Depends(get_db)):
+async def get_file_content(
+    codebase_id: str,
+    path: str,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_db)
+):
     """Get file content"""
-    from app.services.file_service import file_service
     
     # Check if repo exists - if not, we need to clone it. 
     # This might block, so ideally should be done async or beforehand.
     # For now, we assume it's initialized via the Ensure step below.
     
     try:
-        content = file_service.get_file_content(codebase_id, path)
-        if content is None:
+        # Revalidate from a stat alone; the body is only read when it changed
+        etag = file_service.get_file_etag(codebase_id, path)
+        if etag is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": FILE_CACHE_CONTROL})
+        
+        result = await asyncio.to_thread(file_service.get_file_content, codebase_id, path)
+        if result is None:
             raise HTTPException(status_code=404, detail="File not found")
-        return {"content": content}
+        content, truncated = result
+        
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = FILE_CACHE_CONTROL
+        return {"content": content, "truncated": truncated}
+    except HTTPException:
+        raise
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid path")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/codebase/{codebase_id}/raw")
+async def get_file_raw(codebase_id: str, path: str):
+    """Stream a file's bytes as-is (no size cap, no JSON wrapping)"""
+    
+    try:
+        target_file = file_service.resolve_file(codebase_id, path)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid path")
+    if target_file is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    # Sent in chunks from a worker thread, with its own ETag/Last-Modified
+    return FileResponse(target_file, media_type="text/plain")
+
+
 @router.get("/progress/{candidate_id}/overall")
 async def get_overall_progress(candidate_id: int, db: AsyncSession = Depends(get_db)):
     """Calculate overall course progress based on completed weeks"""
-    import traceback
     try:
         # Get Learning Plan to know total weeks
         result = await db.execute(
             select(LearningPlan)
+            .options(undefer(LearningPlan.plan_data), selectinload(LearningPlan.weekly_contents))
             .where(LearningPlan.candidate_id == candidate_id)
             .order_by(desc(LearningPlan.created_at))
             .limit(1)
@@ -918,6 +1032,20 @@ async def get_overall_progress(candidate_id: int, db: AsyncSession = Depends(get
         total_tasks_done = 0
         weeks_progress = []
         
+        # Completed item counts per (week, kind) in a single query
+        result = await db.execute(
+            select(Progress.week_number, ProgressItem.kind, func.count(ProgressItem.id))
+            .join(ProgressItem, ProgressItem.progress_id == Progress.id)
+            .where(Progress.candidate_id == candidate_id)
+            .group_by(Progress.week_number, ProgressItem.kind)
+        )
+        item_counts = {(week_num, kind): count for week_num, kind, count in result.all()}
+        
+        # Every week's progress row in one query (content came with the plan)
+        result = await db.execute(select(Progress).where(Progress.candidate_id == candidate_id))
+        progress_by_week = {progress.week_number: progress for progress in result.scalars()}
+        content_by_week = {content.week_number: content for content in plan.weekly_contents}
+        
         print(f"DEBUG: Calculating progress for Candidate {candidate_id}")
         print(f"DEBUG: Plan ID: {plan.id}, Total Weeks: {total_weeks}")
 
@@ -925,46 +1053,20 @@ async def get_overall_progress(candidate_id: int, db: AsyncSession = Depends(get
         for week in plan.plan_data.get("weeks", []):
             week_num = week.get("week_number")
             
-            # Get Content
-            result = await db.execute(
-                select(WeeklyContent).where(
-                    WeeklyContent.learning_plan_id == plan.id,
-                    WeeklyContent.week_number == week_num
-                ).limit(1)
-            )
-            content = result.scalars().first()
-            
-            # Get Progress
-            result = await db.execute(
-                select(Progress).where(
-                    Progress.candidate_id == candidate_id,
-                    Progress.week_number == week_num
-                ).limit(1)
-            )
-            progress = result.scalars().first()
+            content = content_by_week.get(week_num)
+            progress = progress_by_week.get(week_num)
             
             week_percent = 0
             if content and progress:
                 # 1. Reading Progress (30%)
-                reading_material = content.reading_material or {}
-                reading_text = reading_material.get("content", "")
-                
-                # Simple heuristic: count H2 headers as chapters (same as frontend)
-                # Default to 1 if no headers found but content exists
-                estimated_chapters = max(1, reading_text.count("## "))
-                
-                # Estimate chapters logic
-                import math
-                sections = reading_text.count("## ")
-                total_chapters = max(1, math.ceil(sections / 4)) if sections > 0 else 1
+                total_chapters = content.chapter_count or 1
                 
-                completed_chapters = len(progress.reading_completed) if isinstance(progress.reading_completed, list) else 0
+                completed_chapters = item_counts.get((week_num, PROGRESS_READING), 0)
                 reading_score = min(1.0, completed_chapters / total_chapters)
                 
                 # 2. Tasks Progress (40%)
-                coding_tasks = content.coding_tasks or []
-                total_tasks = len(coding_tasks)
-                completed_tasks = len(progress.tasks_completed) if progress.tasks_completed else 0
+                total_tasks = content.task_count or 0
+                completed_tasks = item_counts.get((week_num, PROGRESS_TASK), 0)
                 tasks_score = 0
                 if total_tasks > 0:
                     tasks_score = min(1.0, completed_tasks / total_tasks)
@@ -972,8 +1074,7 @@ async def get_overall_progress(candidate_id: int, db: AsyncSession = Depends(get
                 total_tasks_done += completed_tasks
                 
                 # 3. Quiz Progress (30%)
-                quiz = content.quiz or []
-                total_quiz = len(quiz)
+                total_quiz = content.quiz_max_score or 0
                 # Quiz score is number of correct answers. 
                 quiz_score_val = progress.quiz_score or 0
                 quiz_score = 0
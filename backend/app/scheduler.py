@@ -6,14 +6,24 @@ Runs hourly to keep master plans up-to-date with latest codebase analysis.
 
 import asyncio
 import logging
+import os
 from datetime import datetime
+from typing import Optional
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
-from sqlalchemy import select, or_, cast, String
+from sqlalchemy import select, update, or_, cast, String
 
-from app.database import AsyncSessionLocal, CodebaseConfig, Candidate
+from app.config import settings
+from app.database import AsyncSessionLocal, CodebaseConfig, Candidate, analysis_fields
 from app.services.plan_template_service import plan_template_service
-from app.services.grok_service import grok_service
+from app.services.grok_service import grok_service, prune_grok_cache
+from app.services.codebase_analyzer import codebase_analyzer
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, so every process runs the scheduler
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
@@ -23,69 +33,94 @@ async def analyze_pending_resumes():
     async with AsyncSessionLocal() as db:
         # Find candidates without resume analysis (handle both SQL NULL and JSON 'null')
         result = await db.execute(
-            select(Candidate).where(
+            select(Candidate.id, Candidate.name, Candidate.resume_text).where(
                 or_(
                     Candidate.resume_analysis == None,
                     cast(Candidate.resume_analysis, String) == 'null'
                 )
-            ).limit(5)
+            ).limit(settings.resume_analysis_batch_size)
         )
-        pending_candidates = result.scalars().all()
+        pending_candidates = result.all()
         
         if not pending_candidates:
             return  # Nothing to do
         
         logger.info(f"🔍 Found {len(pending_candidates)} candidates with pending resume analysis")
         
-        for candidate in pending_candidates:
-            try:
-                logger.info(f"📋 Analyzing resume for candidate {candidate.id} ({candidate.name})...")
-                analysis = await grok_service.analyze_resume(candidate.resume_text)
-                
-                # Update candidate with analysis
-                candidate.resume_analysis = analysis
-                await db.commit()
-                
-                logger.info(f"✅ Completed resume analysis for candidate {candidate.id}")
-            except Exception as e:
-                logger.error(f"❌ Failed to analyze resume for candidate {candidate.id}: {str(e)}")
-                # Don't commit on failure, will retry next run
-                await db.rollback()
-
-
-async def resume_analysis_job():
-    """Async wrapper for resume analysis job"""
-    await analyze_pending_resumes()
+        # The batch size bounds concurrency, so the Grok calls can all overlap
+        async def analyze_one(candidate):
+            logger.info(f"📋 Analyzing resume for candidate {candidate.id} ({candidate.name})...")
+            return await grok_service.analyze_resume(candidate.resume_text)
+        
+        analyses = await asyncio.gather(
+            *(analyze_one(c) for c in pending_candidates),
+            return_exceptions=True
+        )
+        
+        updates = []
+        for candidate, analysis in zip(pending_candidates, analyses):
+            if isinstance(analysis, Exception):
+                # Left pending; retried on the next run
+                logger.error(f"❌ Failed to analyze resume for candidate {candidate.id}: {str(analysis)}")
+                continue
+            
+            updates.append({"id": candidate.id, "resume_analysis": analysis, **analysis_fields(analysis)})
+            logger.info(f"✅ Completed resume analysis for candidate {candidate.id}")
+        
+        if updates:
+            # ORM bulk UPDATE by primary key (executemany, no entities loaded), one commit
+            await db.execute(update(Candidate), updates)
+            await db.commit()
 
 
-async def master_plan_job():
-    """Generate/update master plans for all configured codebases"""
-    async with AsyncSessionLocal() as db:
+async def refresh_master_plan(codebase_id: str, name: str, slots: asyncio.Semaphore):
+    """Regenerate one codebase's master plan in its own session"""
+    async with slots, AsyncSessionLocal() as db:
         try:
-            # Get all configured code bases
-            result = await db.execute(select(CodebaseConfig))
-            codebases = result.scalars().all()
+            # A new plan from the same analysis would repeat the last one (and its cached completions)
+            if not await plan_template_service.master_plan_outdated(codebase_id, db):
+                logger.info(f"  ⏭️  Master plan for {name} ({codebase_id}) is up to date")
+                return
             
-            logger.info(f"🔄 Starting master plan refresh for {len(codebases)} codebases")
+            logger.info(f"  📚 Refreshing master plan for {name} ({codebase_id})")
             
-            for codebase in codebases:
-                try:
-                    logger.info(f"  📚 Refreshing master plan for {codebase.name} ({codebase.id})")
-                    
-                    master_plan = await plan_template_service.generate_master_plan(
-                        codebase.id,
-                        db
-                    )
-                    
-                    logger.info(f"  ✅ Master plan updated: {master_plan['id']}")
-                    
-                except Exception as e:
-                    logger.error(f"  ❌ Failed to refresh master plan for {codebase.id}: {str(e)}")
+            master_plan = await plan_template_service.generate_master_plan(codebase_id, db)
             
-            logger.info("✅ Master plan refresh completed")
+            logger.info(f"  ✅ Master plan updated: {master_plan['id']}")
             
         except Exception as e:
-            logger.error(f"❌ Master plan refresh job failed: {str(e)}")
+            logger.error(f"  ❌ Failed to refresh master plan for {codebase_id}: {str(e)}")
+
+
+async def master_plan_job():
+    """Generate/update master plans for all configured codebases"""
+    try:
+        # Get all configured code bases
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(CodebaseConfig.id, CodebaseConfig.name))
+            codebases = result.all()
+        
+        logger.info(f"🔄 Starting master plan refresh for {len(codebases)} codebases")
+        
+        # Independent per codebase; each refresh gets its own session (an
+        # AsyncSession must not be shared between concurrent tasks)
+        slots = asyncio.Semaphore(settings.master_plan_concurrency)
+        await asyncio.gather(*(refresh_master_plan(cb.id, cb.name, slots) for cb in codebases))
+        
+        logger.info("✅ Master plan refresh completed")
+        
+    except Exception as e:
+        logger.error(f"❌ Master plan refresh job failed: {str(e)}")
+
+
+async def prune_grok_cache_job():
+    """Drop Grok cache entries that have outlived the TTL"""
+    try:
+        removed = await prune_grok_cache()
+        if removed:
+            logger.info(f"🧹 Pruned {removed} expired Grok cache entries")
+    except Exception as e:
+        logger.error(f"❌ Grok cache pruning failed: {str(e)}")
 
 
 class MasterPlanScheduler:
@@ -93,36 +128,95 @@ class MasterPlanScheduler:
     
     def __init__(self):
         self.scheduler = AsyncIOScheduler()
+        self._lock_fd: Optional[int] = None
+    
+    def _acquire_lock(self) -> bool:
+        """Take the host-wide scheduler lock; held until the process exits.
+        
+        uvicorn --workers N starts every worker with the same settings, so a
+        non-blocking flock elects the one that runs the jobs; the others would
+        otherwise duplicate every Grok call and race on the same git checkouts.
+        """
+        if fcntl is None:
+            return True
+        fd = os.open(settings.scheduler_lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
     
-    def start(self):
-        """Start the scheduler"""
+    def start(self) -> bool:
+        """Start the scheduler in at most one process per host; returns whether it started"""
+        if not settings.scheduler_enabled:
+            logger.info("⏸️  Background scheduler disabled (SCHEDULER_ENABLED=false)")
+            return False
+        if not self._acquire_lock():
+            logger.info("⏸️  Background scheduler already running in another worker")
+            return False
+        
         # Master plan refresh - runs hourly
         self.scheduler.add_job(
             master_plan_job,
             trigger=IntervalTrigger(hours=1),
             id='refresh_master_plans',
             name='Refresh Master Plans',
-            replace_existing=True
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
         )
         
         # Resume analysis - runs every 30 seconds
         self.scheduler.add_job(
-            resume_analysis_job,
+            analyze_pending_resumes,
             trigger=IntervalTrigger(seconds=30),
             id='analyze_resumes',
             name='Analyze Pending Resumes',
-            replace_existing=True
+            replace_existing=True,
+            max_instances=1,  # A slow run must not overlap the next tick
+            coalesce=True
+        )
+        
+        # Codebase analysis - runs daily at 2 AM
+        self.scheduler.add_job(
+            codebase_analyzer.analyze_all_codebases,
+            trigger=CronTrigger(hour=2, minute=0),
+            id='daily_codebase_analysis',
+            name='Analyze Codebases',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
+        )
+        
+        # Expired Grok cache entries - pruned hourly
+        self.scheduler.add_job(
+            prune_grok_cache_job,
+            trigger=IntervalTrigger(hours=1),
+            id='prune_grok_cache',
+            name='Prune Grok Cache',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
         )
         
         self.scheduler.start()
         logger.info("🚀 Background scheduler started")
         logger.info("   - Master plan refresh: every hour")
         logger.info("   - Resume analysis: every 30 seconds")
+        logger.info("   - Codebase analysis: daily at 2 AM")
+        logger.info("   - Grok cache pruning: every hour")
+        return True
     
     def shutdown(self):
-        """Shutdown the scheduler"""
-        self.scheduler.shutdown()
-        logger.info("⏹️  Background scheduler stopped")
+        """Shutdown the scheduler (if this process started it) and release the lock"""
+        if self.scheduler.running:
+            self.scheduler.shutdown()
+            logger.info("⏹️  Background scheduler stopped")
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
 
 
 # Singleton instance
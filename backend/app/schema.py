@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import AliasChoices, AliasPath, BaseModel, ConfigDict, EmailStr, Field
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 
@@ -52,6 +52,8 @@ class WeeklyReadingMaterial(BaseModel):
 
 
 class CodingTask(BaseModel):
+    model_config = ConfigDict(coerce_numbers_to_str=True)  # LLMs sometimes emit numeric ids/times
+    
     id: str
     title: str
     description: str
@@ -63,6 +65,8 @@ class CodingTask(BaseModel):
 
 
 class QuizQuestion(BaseModel):
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+    
     id: str
     question: str
     options: List[str]
@@ -70,6 +74,15 @@ class QuizQuestion(BaseModel):
     explanation: str
 
 
+# Grok response envelopes
+class CodingTaskSet(BaseModel):
+    tasks: List[CodingTask] = []
+
+
+class Quiz(BaseModel):
+    questions: List[QuizQuestion] = []
+
+
 class WeeklyContentResponse(BaseModel):
     week_number: int
     reading_material: WeeklyReadingMaterial
@@ -80,15 +93,16 @@ class WeeklyContentResponse(BaseModel):
 class WeekPlan(BaseModel):
     week_number: int
     title: str
-    objectives: List[str]
-    topics: List[str]
+    objectives: List[str] = []
+    topics: List[str] = []
 
 
 class LearningPlanResponse(BaseModel):
+    """Built straight from a LearningPlan row via model_validate (weeks come from plan_data)"""
     id: int
     candidate_id: int
-    codebase_url: str
-    weeks: List[WeekPlan]
+    codebase_url: str = Field(validation_alias=AliasChoices("codebase_url", "codebase_id"))
+    weeks: List[WeekPlan] = Field(validation_alias=AliasChoices("weeks", AliasPath("plan_data", "weeks")))
     created_at: datetime
     
     class Config:
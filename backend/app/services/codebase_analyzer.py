@@ -1,155 +1,217 @@
 import asyncio
 import os
-import tempfile
-import shutil
+import re
+from collections import Counter, defaultdict
 from git import Repo
-from typing import Dict, Any
-from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import datetime
-from sqlalchemy import select
+from typing import DefaultDict, Dict, Any, Optional, Tuple
+from cachetools import TTLCache
+from datetime import datetime, timezone
+from sqlalchemy import select, desc, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import AsyncSessionLocal, CodebaseConfig, CodebaseAnalysis
+from app.config import settings
+from app.database import (
+    AsyncSessionLocal, CodebaseConfig, CodebaseAnalysis,
+    ANALYSIS_PENDING, ANALYSIS_RUNNING, ANALYSIS_COMPLETE, ANALYSIS_FAILED
+)
 from app.services.grok_service import grok_service
+from app.services.file_service import file_service
+
+# Latest completed analysis_data per codebase (plain dicts, treat as read-only)
+_latest_analysis_cache: TTLCache = TTLCache(maxsize=128, ttl=300)
+
+# Serializes git operations on each shared checkout
+_checkout_locks: DefaultDict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+# Directories left out of the file statistics, matched anywhere in a path with
+# one precompiled regex search per file (no per-path split)
+_IGNORED_DIRS = frozenset({'.git', 'node_modules', '__pycache__', 'venv', 'dist', 'build'})
+_IGNORED_PATH_RE = re.compile(
+    r'(?:^|/)(?:' + '|'.join(re.escape(d) for d in sorted(_IGNORED_DIRS)) + r')/'
+)
 
 
 class CodebaseAnalyzer:
     """Service for analyzing pre-configured codebases (e.g., RocksDB GitHub repo)"""
     
-    def __init__(self):
-        self.scheduler = BackgroundScheduler()
-    
-    async def clone_and_analyze(self, codebase_url: str, github_token: str = None) -> Dict[str, Any]:
-        """Clone repository and perform analysis"""
-        temp_dir = None
-        try:
-            # Create temporary directory
-            temp_dir = tempfile.mkdtemp()
-            
-            # Clone repository
-            print(f"Cloning {codebase_url}...")
-            if github_token:
-                url_parts = codebase_url.replace('https://', '').split('/')
-                auth_url = f"https://{github_token}@{'/'.join(url_parts)}"
-                repo = Repo.clone_from(auth_url, temp_dir, depth=1)
-            else:
-                repo = Repo.clone_from(codebase_url, temp_dir, depth=1)
-            
-            # Analyze codebase structure
-            analysis = await self._analyze_local_codebase(temp_dir, codebase_url)
-            
-            return analysis
+    async def clone_and_analyze(
+        self,
+        codebase_id: str,
+        codebase_url: str,
+        github_token: str = None
+    ) -> Dict[str, Any]:
+        """Bring the shared checkout up to date (shallow fetch, or clone once) and analyze it"""
+        # Same cache the file browser uses, so either one warms it for the other.
+        # One git operation per checkout at a time, even with parallel workers.
+        async with _checkout_locks[codebase_id]:
+            updated = await asyncio.to_thread(
+                file_service.ensure_repo_exists,
+                codebase_id,
+                codebase_url,
+                force_update=True,
+                github_token=github_token
+            )
+            if not updated:
+                raise RuntimeError(f"Could not clone or update {codebase_url}")
             
-        finally:
-            # Cleanup
-            if temp_dir and os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
+            return await self._analyze_local_codebase(str(file_service.get_repo_path(codebase_id)), codebase_url)
+    
+    @staticmethod
+    def _repo_file_stats(repo_path: str) -> Tuple[int, Dict[str, int]]:
+        """File count and per-extension counts for HEAD, read from git's index
+        (one ls-tree pipe instead of a stat per file in the working copy)"""
+        names = Repo(repo_path).git.ls_tree("-r", "--name-only", "HEAD").splitlines()
+        names = [n for n in names if not _IGNORED_PATH_RE.search(n)]
+        
+        language_stats = Counter(os.path.splitext(n)[1] for n in names)
+        language_stats.pop("", None)
+        return len(names), dict(language_stats)
     
     async def _analyze_local_codebase(self, repo_path: str, repo_url: str) -> Dict[str, Any]:
         """Analyze local codebase directory"""
-        # Get basic repository statistics
-        file_count = 0
-        language_stats = {}
-        
-        for root, dirs, files in os.walk(repo_path):
-            dirs[:] = [d for d in dirs if d not in ['.git', 'node_modules', '__pycache__', 'venv', 'dist', 'build']]
-            
-            for file in files:
-                file_count += 1
-                ext = os.path.splitext(file)[1]
-                if ext:
-                    language_stats[ext] = language_stats.get(ext, 0) + 1
-        
-        # Use Grok to analyze the codebase
-        analysis = await grok_service.analyze_codebase(repo_url)
+        # Repository statistics (worker thread) and the Grok analysis overlap
+        (file_count, language_stats), analysis = await asyncio.gather(
+            asyncio.to_thread(self._repo_file_stats, repo_path),
+            grok_service.analyze_codebase(repo_url)
+        )
         
         # Enhance with local stats
         analysis['local_stats'] = {
             'file_count': file_count,
             'language_distribution': language_stats,
-            'analyzed_at': datetime.utcnow().isoformat()
+            'analyzed_at': datetime.now(timezone.utc).isoformat()
         }
         
         return analysis
     
+    async def get_latest_analysis(self, codebase_id: str, db: AsyncSession) -> Optional[Dict[str, Any]]:
+        """Latest completed analysis for a codebase, cached for a few minutes"""
+        cached = _latest_analysis_cache.get(codebase_id)
+        if cached is not None:
+            return cached
+        
+        result = await db.execute(
+            select(CodebaseAnalysis.analysis_data)
+            .where(
+                CodebaseAnalysis.codebase_id == codebase_id,
+                CodebaseAnalysis.status == ANALYSIS_COMPLETE
+            )
+            .order_by(desc(CodebaseAnalysis.analyzed_at))
+            .limit(1)
+        )
+        analysis_data = result.scalar_one_or_none()
+        
+        if analysis_data is not None:
+            _latest_analysis_cache[codebase_id] = analysis_data
+        return analysis_data
+    
+    def invalidate_latest_analysis(self, codebase_id: Optional[str] = None):
+        """Drop the cached analysis for one codebase (or all of them)"""
+        if codebase_id is None:
+            _latest_analysis_cache.clear()
+        else:
+            _latest_analysis_cache.pop(codebase_id, None)
+    
     async def analyze_configured_codebase(self, codebase_id: str):
-        """Analyze a pre-configured codebase and save results to SQLite"""
+        """Queue an analysis for a pre-configured codebase and run it"""
         print(f"Starting analysis for codebase: {codebase_id}")
         
         async with AsyncSessionLocal() as db:
-            # Get codebase configuration
-            result = await db.execute(
-                select(CodebaseConfig).where(CodebaseConfig.id == codebase_id)
-            )
-            config = result.scalar_one_or_none()
+            config = await db.get(CodebaseConfig, codebase_id)
             
             if not config:
                 print(f"Codebase {codebase_id} not found")
                 return
             
-            try:
-                # Perform analysis
-                analysis_data = await self.clone_and_analyze(
-                    config.repository_url,
-                    config.github_token
-                )
+            db.add(CodebaseAnalysis(codebase_id=codebase_id))
+            await db.commit()
+        
+        await self.process_pending_analyses(codebase_id)
+    
+    async def _claim_pending_analysis(
+        self,
+        db: AsyncSession,
+        codebase_id: Optional[str] = None
+    ) -> Optional[CodebaseAnalysis]:
+        """Claim one pending analysis row; concurrent workers skip rows already locked"""
+        while True:
+            stmt = (
+                select(CodebaseAnalysis.id)
+                .where(CodebaseAnalysis.status == ANALYSIS_PENDING)
+                .order_by(CodebaseAnalysis.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            if codebase_id:
+                stmt = stmt.where(CodebaseAnalysis.codebase_id == codebase_id)
+            
+            result = await db.execute(stmt)
+            analysis_id = result.scalar_one_or_none()
+            
+            if analysis_id is None:
+                return None
+            
+            # Conditional flip, so two workers can never both claim a row (SQLite has no row locks)
+            claimed = await db.execute(
+                update(CodebaseAnalysis)
+                .where(CodebaseAnalysis.id == analysis_id, CodebaseAnalysis.status == ANALYSIS_PENDING)
+                .values(status=ANALYSIS_RUNNING)
+            )
+            await db.commit()
+            
+            if claimed.rowcount:
+                return await db.get(CodebaseAnalysis, analysis_id)
+    
+    async def process_pending_analyses(self, codebase_id: Optional[str] = None):
+        """Run pending analyses until none are left (safe to run in several workers)"""
+        while True:
+            async with AsyncSessionLocal() as db:
+                analysis = await self._claim_pending_analysis(db, codebase_id)
                 
-                # Save analysis results
-                analysis = CodebaseAnalysis(
-                    codebase_id=codebase_id,
-                    analysis_data=analysis_data,
-                    analyzed_at=datetime.utcnow()
-                )
+                if not analysis:
+                    return
                 
-                db.add(analysis)
-                await db.commit()
+                config = await db.get(CodebaseConfig, analysis.codebase_id)
                 
-                print(f"Successfully analyzed codebase: {codebase_id}")
+                try:
+                    # Perform analysis
+                    analysis.analysis_data = await self.clone_and_analyze(
+                        config.id,
+                        config.repository_url,
+                        config.github_token
+                    )
+                    analysis.status = ANALYSIS_COMPLETE
+                    analysis.analyzed_at = func.now()
+                    
+                    print(f"Successfully analyzed codebase: {analysis.codebase_id}")
+                    
+                except Exception as e:
+                    print(f"Error analyzing codebase {analysis.codebase_id}: {str(e)}")
+                    analysis.status = ANALYSIS_FAILED
+                
+                await db.commit()
                 
-            except Exception as e:
-                print(f"Error analyzing codebase {codebase_id}: {str(e)}")
-                await db.rollback()
+                if analysis.status == ANALYSIS_COMPLETE:
+                    self.invalidate_latest_analysis(analysis.codebase_id)
     
-    def analyze_all_codebases(self):
-        """Analyze all pre-configured codebases (called by scheduler)"""
-        print(f"[{datetime.utcnow()}] Running daily codebase analysis...")
+    async def analyze_all_codebases(self):
+        """Queue an analysis for every configured codebase, then work through the queue
+        (the daily job, registered on the app's AsyncIOScheduler)"""
+        print(f"[{datetime.now(timezone.utc)}] Running daily codebase analysis...")
         
-        # Run analysis in event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(self._analyze_all_async())
-        loop.close()
-    
-    async def _analyze_all_async(self):
-        """Async method to analyze all codebases"""
         async with AsyncSessionLocal() as db:
-            result = await db.execute(select(CodebaseConfig))
-            codebases = result.scalars().all()
+            result = await db.execute(select(CodebaseConfig.id))
             
-            for config in codebases:
-                try:
-                    await self.analyze_configured_codebase(config.id)
-                except Exception as e:
-                    print(f"Error analyzing {config.id}: {str(e)}")
-    
-    def start_scheduler(self):
-        """Start the background scheduler for daily analysis"""
-        # Run analysis daily at 2 AM
-        self.scheduler.add_job(
-            self.analyze_all_codebases,
-            trigger='cron',
-            hour=2,
-            minute=0,
-            id='daily_codebase_analysis'
-        )
+            for codebase_id in result.scalars().all():
+                db.add(CodebaseAnalysis(codebase_id=codebase_id))
+            
+            await db.commit()
         
-        self.scheduler.start()
-        print("Codebase analysis scheduler started (runs daily at 2 AM)")
-    
-    def stop_scheduler(self):
-        """Stop the scheduler"""
-        if self.scheduler.running:
-            self.scheduler.shutdown()
-            print("Codebase analysis scheduler stopped")
+        # A few queue workers in parallel; each claims rows in its own sessions
+        await asyncio.gather(*(
+            self.process_pending_analyses()
+            for _ in range(settings.codebase_analysis_concurrency)
+        ))
 
 
 # Global instance
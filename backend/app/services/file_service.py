@@ -1,92 +1,202 @@
+import codecs
 import os
 import shutil
-from typing import List, Dict, Any, Optional
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+from cachetools import LRUCache, TTLCache
 from git import Repo
 from pathlib import Path
 
+# The JSON content endpoint returns at most this much of a file (flagged as truncated)
+MAX_VIEW_BYTES = 1_000_000
+
+# Files up to this size are kept in the content cache; larger ones are read each time
+MAX_CACHED_FILE_BYTES = 256 * 1024
+
+# Total size of the content cache (in characters of decoded text), evicting least recently used
+CONTENT_CACHE_BUDGET = 32 * 1024 * 1024
+
+BINARY_PLACEHOLDER = "<Binary file or non-UTF-8 content>"
+
+# Directory listings keyed by (codebase_id, subdir, dir mtime); the TTL covers
+# in-place file edits, which change sizes without touching the directory mtime
+_listing_cache: TTLCache = TTLCache(maxsize=256, ttl=60)
+_listing_lock = threading.Lock()  # listings are also built from worker threads
+
+# Decoded file contents keyed by (path, mtime_ns), so edits invalidate; bounded by
+# total text size rather than entry count
+_content_cache: LRUCache = LRUCache(maxsize=CONTENT_CACHE_BUDGET, getsizeof=lambda entry: len(entry[0]))
+_content_lock = threading.Lock()  # files are read from worker threads
+
+
+def _read_text_cached(path: str, mtime_ns: int) -> Tuple[str, bool]:
+    """_read_text through the content cache"""
+    key = (path, mtime_ns)
+    with _content_lock:
+        cached = _content_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    entry = _read_text(path)
+    with _content_lock:
+        _content_cache[key] = entry
+    return entry
+
+
+def _read_text(path: str) -> Tuple[str, bool]:
+    """(text, truncated) for the first MAX_VIEW_BYTES of a file"""
+    with open(path, 'rb') as f:
+        data = f.read(MAX_VIEW_BYTES + 1)
+    truncated = len(data) > MAX_VIEW_BYTES
+    if truncated:
+        data = data[:MAX_VIEW_BYTES]
+    
+    try:
+        # Incremental decode tolerates a multi-byte character cut off by the cap
+        return codecs.getincrementaldecoder('utf-8')().decode(data, final=not truncated), truncated
+    except UnicodeDecodeError:
+        # For code viewer, we simply say "Binary file"
+        return BINARY_PLACEHOLDER, False
+
+
 class FileService:
     def __init__(self, storage_dir: str = "storage/codebases"):
         self.storage_dir = Path(storage_dir)
         self.storage_dir.mkdir(parents=True, exist_ok=True)
 
-    def _get_repo_path(self, codebase_id: str) -> Path:
+    def get_repo_path(self, codebase_id: str) -> Path:
         return self.storage_dir / codebase_id
 
-    def ensure_repo_exists(self, codebase_id: str, repo_url: str) -> bool:
-        """Clones the repo if it doesn't exist."""
-        repo_path = self._get_repo_path(codebase_id)
+    def _resolve_in_repo(self, codebase_id: str, rel_path: str) -> Path:
+        """Resolved path of rel_path inside a repo; ValueError if it escapes it.
+        
+        Compares resolved paths, so ../ segments, absolute paths, and symlinks
+        pointing outside the checkout are all rejected.
+        """
+        storage_dir = self.storage_dir.resolve()
+        repo_path = (storage_dir / codebase_id).resolve()
+        if repo_path.parent != storage_dir:
+            raise ValueError("Invalid path")
+        
+        target = (repo_path / rel_path).resolve()
+        if target != repo_path and repo_path not in target.parents:
+            raise ValueError("Invalid path")
+        return target
+
+    def ensure_repo_exists(
+        self,
+        codebase_id: str,
+        repo_url: str,
+        force_update: bool = False,
+        github_token: Optional[str] = None
+    ) -> bool:
+        """Clones the repo if it doesn't exist; with force_update, fast-forwards an
+        existing checkout to the remote HEAD with a shallow fetch instead of re-cloning.
+        
+        The token is only used for the network call and is never written to .git/config.
+        """
+        repo_path = self.get_repo_path(codebase_id)
+        fetch_url = self._authenticated_url(repo_url, github_token)
         
         if repo_path.exists():
-            # In a real app, we might want to git pull here
-            return True
+            if not force_update:
+                return True
+            
+            try:
+                print(f"Updating {repo_url} in {repo_path}...")
+                repo = Repo(repo_path)
+                repo.git.fetch("--depth=1", "--filter=blob:none", fetch_url)
+                repo.git.reset("--hard", "FETCH_HEAD")
+                return True
+            except Exception as e:
+                # Broken or foreign checkout: fall back to a fresh clone
+                print(f"Failed to update repo, re-cloning: {e}")
+                shutil.rmtree(repo_path, ignore_errors=True)
             
         try:
             print(f"Cloning {repo_url} to {repo_path}...")
-            Repo.clone_from(repo_url, repo_path, depth=1)
+            # Blobless partial clone: trees come up front, blobs only as checkout
+            # (or a later reset) needs them, so refreshes pull just changed files
+            repo = Repo.clone_from(fetch_url, repo_path, depth=1, filter="blob:none")
+            if fetch_url != repo_url:
+                repo.remotes.origin.set_url(repo_url)
             return True
         except Exception as e:
             print(f"Failed to clone repo: {e}")
             return False
 
+    @staticmethod
+    def _authenticated_url(repo_url: str, github_token: Optional[str]) -> str:
+        if not github_token:
+            return repo_url
+        return f"https://{github_token}@{repo_url.replace('https://', '')}"
+
     def list_files(self, codebase_id: str, subdir: str = "") -> List[Dict[str, Any]]:
         """Lists files and directories in a specific subdirectory."""
-        repo_path = self._get_repo_path(codebase_id)
-        target_dir = repo_path / subdir
-        
         # Security check to prevent directory traversal
-        try:
-            target_dir.relative_to(repo_path)
-        except ValueError:
-            raise ValueError("Invalid path")
+        target_dir = self._resolve_in_repo(codebase_id, subdir)
 
         if not target_dir.exists() or not target_dir.is_dir():
             return []
 
-        items = []
+        cache_key = (codebase_id, subdir, target_dir.stat().st_mtime_ns)
+        with _listing_lock:
+            cached = _listing_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        prefix = subdir.strip('/')
         try:
+            # One is_dir() per entry (DirEntry caches it, and stat() on Linux)
+            with os.scandir(target_dir) as it:
+                entries = [(e, e.is_dir()) for e in it if not e.name.startswith('.git')]
+            
             # Sort: directories first, then files
-            with os.scandir(target_dir) as entries:
-                sorted_entries = sorted(entries, key=lambda e: (not e.is_dir(), e.name.lower()))
-                
-                for entry in sorted_entries:
-                    if entry.name.startswith('.git'):
-                        continue
-                        
-                    items.append({
-                        "name": entry.name,
-                        "path": str(Path(subdir) / entry.name).replace('\\', '/'),
-                        "type": "dir" if entry.is_dir() else "file",
-                        "size": entry.stat().st_size if entry.is_file() else 0
-                    })
+            entries.sort(key=lambda t: (not t[1], t[0].name.lower()))
+            
+            items = [
+                {
+                    "name": entry.name,
+                    "path": f"{prefix}/{entry.name}" if prefix else entry.name,
+                    "type": "dir" if is_dir else "file",
+                    "size": entry.stat().st_size if not is_dir and entry.is_file() else 0
+                }
+                for entry, is_dir in entries
+            ]
         except Exception as e:
             print(f"Error reading directory: {e}")
             return []
             
+        with _listing_lock:
+            _listing_cache[cache_key] = items
         return items
 
-    def get_file_content(self, codebase_id: str, file_path: str) -> Optional[str]:
-        """Reads the content of a file."""
-        repo_path = self._get_repo_path(codebase_id)
-        target_file = repo_path / file_path
-        
-        try:
-            target_file.relative_to(repo_path)
-        except ValueError:
-            raise ValueError("Invalid path")
+    def resolve_file(self, codebase_id: str, file_path: str) -> Optional[Path]:
+        """Path of an existing file inside the repo (None if missing); ValueError if outside it."""
+        target_file = self._resolve_in_repo(codebase_id, file_path)
 
         if not target_file.exists() or not target_file.is_file():
             return None
+        return target_file
 
-        try:
-            # Try UTF-8 first
-            return target_file.read_text(encoding='utf-8')
-        except UnicodeDecodeError:
-            try:
-                # Fallback to latin-1 for some mixed content, or generally binary
-                # For code viewer, we might simply say "Binary file"
-                return "<Binary file or non-UTF-8 content>"
-            except Exception:
-                return None
+    def get_file_etag(self, codebase_id: str, file_path: str) -> Optional[str]:
+        """Weak validator from a single stat (mtime + size); no read or hashing."""
+        target_file = self.resolve_file(codebase_id, file_path)
+        if target_file is None:
+            return None
+        stat = target_file.stat()
+        return f'W/"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def get_file_content(self, codebase_id: str, file_path: str) -> Optional[Tuple[str, bool]]:
+        """Reads the content of a file as (text, truncated), capped at MAX_VIEW_BYTES."""
+        target_file = self.resolve_file(codebase_id, file_path)
+        if target_file is None:
+            return None
+
+        stat = target_file.stat()
+        if stat.st_size > MAX_CACHED_FILE_BYTES:
+            return _read_text(str(target_file))
+        return _read_text_cached(str(target_file), stat.st_mtime_ns)
 
 
 # Use ~/xHack as the default storage directory
@@ -1,234 +1,287 @@
+import asyncio
+import hashlib
 import httpx
-import json
-from typing import Dict, Any, List, Optional
+import math
+import orjson
+import re
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional, Tuple, Type, Union
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select, delete, func, desc
 from app.config import get_settings
+from app.database import AsyncSessionLocal, GrokResponseCache, GrokSemanticCache, dialect_insert
+from app.schema import ResumeAnalysis, WeeklyReadingMaterial, CodingTaskSet, Quiz
 
 settings = get_settings()
 
+# Onboarding expectation prompts are static files; read them once at import
+EXPECTATION_PROMPTS_DIR = Path(__file__).parent.parent.parent / "expectation_prompts"
+_EXPECTATION_PROMPTS = {
+    name: (EXPECTATION_PROMPTS_DIR / name).read_text()
+    for name in ("senior_engineer_prompt.md", "junior_engineer_prompt.md")
+    if (EXPECTATION_PROMPTS_DIR / name).exists()
+}
 
-class GrokService:
-    """Service for interacting with Grok API"""
+
+def expectation_prompt_file(level: str) -> str:
+    """Expectation prompt file name for an experience level"""
+    if "senior" in level or "staff" in level or "lead" in level:
+        return "senior_engineer_prompt.md"
+    return "junior_engineer_prompt.md"
+
+
+def get_expectation_prompt(level: str) -> Optional[str]:
+    """Cached expectation prompt for an experience level (None if the file is missing)"""
+    return _EXPECTATION_PROMPTS.get(expectation_prompt_file(level))
+
+
+def prompt_json(value: Any) -> str:
+    """Compact JSON for embedding structured context in a prompt (indentation only costs tokens)"""
+    return orjson.dumps(value, option=orjson.OPT_SORT_KEYS).decode()
+
+
+def codebase_digest(codebase_analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """Compact codebase context for per-week prompts (the full analysis only feeds the plan outline)"""
+    return {
+        "tech_stack": codebase_analysis.get("tech_stack", []),
+        "components": [
+            c.get("name") if isinstance(c, dict) else c
+            for c in codebase_analysis.get("main_components", [])
+        ],
+        "patterns": codebase_analysis.get("key_patterns", [])
+    }
+
+
+def codebase_context(codebase_analysis: Dict[str, Any]) -> str:
+    """Serialized codebase digest; build it once when generating several weeks"""
+    return prompt_json(codebase_digest(codebase_analysis))
+
+
+def _response_cache_key(model: str, temperature: float, messages: List[Dict[str, str]]) -> str:
+    """Exact-match cache key for a completion request"""
+    request = {"m": model, "t": temperature, "msgs": messages}
+    return hashlib.sha256(orjson.dumps(request, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+async def _cached_response(key: str) -> Optional[str]:
+    """Stored completion for a key, unless missing or older than the TTL"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(GrokResponseCache.payload, GrokResponseCache.created_at).where(GrokResponseCache.key == key)
+        )
+        row = result.first()
     
-    def __init__(self):
-        self.api_key = settings.xai_api_key
-        self.base_url = settings.xai_base_url
-        self.model = settings.xai_model
-        self.resume_model = settings.xai_resume_model  # Cheaper model for resume analysis
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+    if row is None:
+        return None
+    created_at = row.created_at
+    if created_at.tzinfo is None:  # SQLite returns naive UTC timestamps
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    if datetime.now(timezone.utc) - created_at > timedelta(seconds=settings.grok_cache_ttl):
+        return None
+    return row.payload
+
+
+async def _store_response(key: str, payload: str):
+    async with AsyncSessionLocal() as db:
+        insert = dialect_insert(db)
+        stmt = insert(GrokResponseCache).values(key=key, payload=payload)
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[GrokResponseCache.key],
+            set_={"payload": stmt.excluded.payload, "created_at": func.now()}
+        ))
+        await db.commit()
+
+
+# Semantic cache: texts are embedded as feature-hashed token counts, so near-duplicate
+# inputs (a resume with a few edited lines) land close together without a model download.
+EMBEDDING_DIMS = 1024
+SEMANTIC_CACHE_SCAN_LIMIT = 2000  # Most recent entries compared per lookup
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _text_embedding(text: str) -> array:
+    """Unit-length hashed bag-of-words vector for a text"""
+    vector = array("f", bytes(4 * EMBEDDING_DIMS))
+    for token in _TOKEN_RE.findall(text.lower()):
+        vector[zlib.crc32(token.encode()) % EMBEDDING_DIMS] += 1.0
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm:
+        for i, v in enumerate(vector):
+            if v:
+                vector[i] = v / norm
+    return vector
+
+
+def _cosine(a: array, b: array) -> float:
+    return sum(x * y for x, y in zip(a, b) if x)
+
+
+async def _similar_response(scope: str, text: str, threshold: float) -> Optional[str]:
+    """Most similar stored completion for a scope, if it clears the threshold and TTL"""
+    query = await asyncio.to_thread(_text_embedding, text)
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(GrokSemanticCache.embedding, GrokSemanticCache.payload, GrokSemanticCache.created_at)
+            .where(GrokSemanticCache.scope == scope)
+            .order_by(desc(GrokSemanticCache.id))
+            .limit(SEMANTIC_CACHE_SCAN_LIMIT)
+        )
+        rows = result.all()
     
-    async def _make_request(self, messages: List[Dict[str, str]], temperature: float = 0.7, model: str = None) -> str:
-        """Make a request to Grok API"""
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            payload = {
-                "model": model or self.model,
-                "messages": messages,
-                "temperature": temperature,
-                "stream": False
-            }
-            
-            response = await client.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload
-            )
-            response.raise_for_status()
-            
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
+    # Scoring a few thousand vectors is CPU-bound; keep it off the event loop
+    return await asyncio.to_thread(_best_match, query, rows, threshold)
+
+
+def _best_match(query: array, rows, threshold: float) -> Optional[str]:
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.grok_cache_ttl)
+    best, best_score = None, threshold
+    for row in rows:
+        created_at = row.created_at
+        if created_at.tzinfo is None:  # SQLite returns naive UTC timestamps
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        if created_at < cutoff:
+            continue
+        stored = array("f")
+        stored.frombytes(row.embedding)
+        score = _cosine(query, stored)
+        if score >= best_score:
+            best, best_score = row.payload, score
+    return best
+
+
+async def _store_similar_response(scope: str, text: str, payload: str):
+    async with AsyncSessionLocal() as db:
+        db.add(GrokSemanticCache(scope=scope, embedding=_text_embedding(text).tobytes(), payload=payload))
+        await db.commit()
+
+
+async def prune_grok_cache() -> int:
+    """Delete exact and semantic cache entries older than the TTL; returns rows removed"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.grok_cache_ttl)
+    async with AsyncSessionLocal() as db:
+        removed = 0
+        for table in (GrokResponseCache, GrokSemanticCache):
+            result = await db.execute(delete(table).where(table.created_at < cutoff))
+            removed += result.rowcount
+        await db.commit()
+    return removed
+
+
+class _JsonSpanScanner:
+    """Brace/quote state machine locating the first balanced JSON object/array.
     
-    def _parse_json_response(self, response: str) -> Dict[str, Any]:
-        """Parse JSON from Grok response with robust error handling"""
-        import re
-        
-        # Try direct parsing first
-        try:
-            return json.loads(response)
-        except json.JSONDecodeError:
-            pass
-        
-        # Try extracting from markdown code blocks
-        if "```json" in response:
-            json_str = response.split("```json")[1].split("```")[0].strip()
-        elif "```" in response:
-            json_str = response.split("```")[1].split("```")[0].strip()
-        else:
-            # Try to find JSON object in response
-            match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', response, re.DOTALL)
-            if match:
-                json_str = match.group(0)
-            else:
-                raise ValueError(f"Could not parse JSON from response: {response[:200]}")
-        
-        # Clean the string
-        json_str = json_str.strip()
-        
-        # Try parsing
-        try:
-            return json.loads(json_str)
-        except json.JSONDecodeError as e:
-            # Last resort: try to fix common JSON errors
-            json_str = json_str.replace("\n", " ").replace("\r", "")
-            return json.loads(json_str)
+    Text can be fed in pieces (e.g. streamed deltas); positions are offsets into
+    everything fed so far.
+    """
     
-    async def analyze_resume(self, resume_text: str) -> Dict[str, Any]:
-        """Analyze resume to understand candidate background"""
-        prompt = f"""Analyze this resume and provide a structured assessment:
+    def __init__(self):
+        self.first = -1
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.fed = 0  # Characters consumed by previous feed() calls
+    
+    def feed(self, text: str, start: int = 0, end: Optional[int] = None) -> int:
+        """Scan text[start:end]; end offset of the span once it closes, else -1"""
+        if end is None:
+            end = len(text)
+        base = self.fed - start
+        self.fed += end - start
+        first, depth, in_string, escape = self.first, self.depth, self.in_string, self.escape
+        for i in range(start, end):
+            c = text[i]
+            if first < 0:
+                if c == "{" or c == "[":
+                    first, depth = base + i, 1
+            elif in_string:
+                if escape:
+                    escape = False
+                elif c == "\\":
+                    escape = True
+                elif c == '"':
+                    in_string = False
+            elif c == '"':
+                in_string = True
+            elif c == "{" or c == "[":
+                depth += 1
+            elif c == "}" or c == "]":
+                depth -= 1
+                if depth == 0:
+                    self.first, self.depth = first, 0
+                    return base + i + 1
+        self.first, self.depth, self.in_string, self.escape = first, depth, in_string, escape
+        return -1
+
+
+def _extract_json_span(text: str, start: int = 0, end: Optional[int] = None) -> Tuple[int, int]:
+    """(first, last) slice bounds of the first balanced JSON object/array in text[start:end].
+    
+    (-1, -1) if none is found.
+    """
+    scanner = _JsonSpanScanner()
+    last = scanner.feed(text, start, end)
+    if last < 0:
+        return -1, -1
+    return start + scanner.first, start + last
+
 
-Resume:
-{resume_text}
+# Prompt layout: persona (system) and the static instructions/schema come first and
+# are byte-identical across calls, so providers with prefix caching can reuse them;
+# everything call-specific goes in the final message.
+_RESUME_ANALYSIS_INSTRUCTIONS = """Analyze the resume in the next message and provide a structured assessment.
 
 Provide analysis in JSON format with the following structure:
-{{
+{
     "background": "Brief summary of candidate's background",
     "skills": ["skill1", "skill2", ...],
     "experience_level": "junior|mid|senior",
     "strengths": ["strength1", "strength2", ...],
     "learning_areas": ["area1", "area2", ...]
-}}
+}
 
 Focus on technical skills, experience level, and areas where the candidate could benefit from additional learning."""
 
-        messages = [
-            {"role": "system", "content": "You are an expert technical recruiter and career advisor. Analyze resumes thoroughly and provide actionable insights."},
-            {"role": "user", "content": prompt}
-        ]
-        
-        # Use cheaper model for resume analysis
-        response = await self._make_request(messages, temperature=0.3, model=self.resume_model)
-        
-        # Extract JSON from response
-        try:
-            # Try to parse as JSON directly
-            analysis = json.loads(response)
-        except json.JSONDecodeError:
-            # If not pure JSON, try to extract JSON from markdown code block
-            if "```json" in response:
-                json_str = response.split("```json")[1].split("```")[0].strip()
-                analysis = json.loads(json_str)
-            elif "```" in response:
-                json_str = response.split("```")[1].split("```")[0].strip()
-                analysis = json.loads(json_str)
-            else:
-                raise ValueError("Could not parse JSON from Grok response")
+_RAMP_UP_INSTRUCTIONS = """Based on the onboarding philosophy and the candidate's analysis in the next message, write a concise (2-3 sentences) "Ramp Up Expectation" message to the candidate.
 
-        # Generate Ramp Up Expectation based on level
-        try:
-            level = analysis.get("experience_level", "junior").lower()
-            if "senior" in level or "staff" in level or "lead" in level:
-                prompt_file = "senior_engineer_prompt.md"
-            else:
-                prompt_file = "junior_engineer_prompt.md"
+The message should set the tone for their first 4 weeks, highlighting what matters most (e.g., specific deep dives for seniors vs. practical tasks for juniors).
+Directly address the candidate ("You will focus on..."). keep it under 50 words."""
 
-            from pathlib import Path
-            # Assuming running from backend root or app root
-            # Try to find the file relative to current file or project root
-            base_path = Path(__file__).parent.parent.parent / "expectation_prompts"
-            prompt_path = base_path / prompt_file
-            
-            if prompt_path.exists():
-                with open(prompt_path, "r") as f:
-                    expectation_context = f.read()
-
-                exp_prompt = f"""Based on the candidate's analysis and the following onboarding philosophy, write a concise (2-3 sentences) "Ramp Up Expectation" message to the candidate.
-                
-                Candidate Background: {analysis.get('background')}
-                Experience Level: {level}
-                
-                Onboarding Philosophy:
-                {expectation_context}
-                
-                The message should set the tone for their first 4 weeks, highlighting what matters most (e.g., specific deep dives for seniors vs. practical tasks for juniors).
-                Directly address the candidate ("You will focus on..."). keep it under 50 words."""
-
-                exp_messages = [
-                    {"role": "system", "content": "You are a thoughtful engineering manager setting expectations for a new hire."},
-                    {"role": "user", "content": exp_prompt}
-                ]
-
-                expectation_text = await self._make_request(exp_messages, temperature=0.5, model=self.resume_model)
-                analysis["ramp_up_expectation"] = expectation_text.strip()
-            else:
-                print(f"Warning: Expectation prompt file not found at {prompt_path}")
-                analysis["ramp_up_expectation"] = "Welcome to the team! We are excited to have you onboard and look forward to seeing your contributions."
-
-        except Exception as e:
-            print(f"Error generating expectation: {e}")
-            analysis["ramp_up_expectation"] = "Welcome to the team! We look forward to your ramp up."
-        
-        return analysis
-    
-    async def analyze_codebase(self, codebase_url: str, github_token: Optional[str] = None) -> Dict[str, Any]:
-        """Analyze codebase structure and dependencies using Grok"""
-        prompt = f"""Analyze this codebase repository: {codebase_url}
+_CODEBASE_ANALYSIS_INSTRUCTIONS = """Analyze the codebase repository named in the next message.
 
 Provide a comprehensive analysis in JSON format:
-{{
+{
     "tech_stack": ["technology1", "technology2", ...],
     "architecture": "Brief description of the architecture",
     "main_components": [
-        {{"name": "component1", "description": "...", "complexity": "low|medium|high"}},
+        {"name": "component1", "description": "...", "complexity": "low|medium|high"},
         ...
     ],
     "dependencies": ["dependency1", "dependency2", ...],
     "key_patterns": ["pattern1", "pattern2", ...],
     "recommended_learning_path": ["topic1", "topic2", ...]
-}}
+}
 
 Focus on understanding the codebase structure to help create a learning plan for new hires."""
 
-        messages = [
-            {"role": "system", "content": "You are an expert software architect who specializes in onboarding new team members. Analyze codebases to create effective learning paths."},
-            {"role": "user", "content": prompt}
-        ]
-        
-        response = await self._make_request(messages, temperature=0.3)
-        
-        # Extract JSON from response
-        try:
-            analysis = json.loads(response)
-        except json.JSONDecodeError:
-            if "```json" in response:
-                json_str = response.split("```json")[1].split("```")[0].strip()
-                analysis = json.loads(json_str)
-            elif "```" in response:
-                json_str = response.split("```")[1].split("```")[0].strip()
-                analysis = json.loads(json_str)
-            else:
-                raise ValueError("Could not parse JSON from Grok response")
-        
-        return analysis
-    
-    async def generate_learning_plan(
-        self, 
-        resume_analysis: Dict[str, Any], 
-        codebase_analysis: Dict[str, Any]
-    ) -> Dict[str, Any]:
-        """Generate 4-week personalized learning plan"""
-        prompt = f"""Create a personalized 4-week onboarding learning plan for a new hire.
-
-Candidate Profile:
-{json.dumps(resume_analysis, indent=2)}
-
-Codebase Analysis:
-{json.dumps(codebase_analysis, indent=2)}
+_LEARNING_PLAN_INSTRUCTIONS = """Create a personalized 4-week onboarding learning plan for the new hire whose profile is in the next message, for the codebase analyzed there.
 
 Generate a comprehensive 4-week plan in JSON format:
-{{
+{
     "overview": "Brief overview of the learning journey",
     "weeks": [
-        {{
+        {
             "week_number": 1,
             "title": "Week 1 title",
             "objectives": ["objective1", "objective2", ...],
             "topics": ["topic1", "topic2", ...],
             "focus_areas": ["area1", "area2", ...]
-        }},
+        },
         ... (for all 4 weeks)
     ]
-}}
+}
 
 The plan should:
 - Start with fundamentals and gradually increase complexity
@@ -237,127 +290,37 @@ The plan should:
 - Include both theoretical knowledge and practical coding
 - Be realistic and achievable within 4 weeks"""
 
-        messages = [
-            {"role": "system", "content": "You are an expert technical mentor who designs effective onboarding programs. Create structured, personalized learning plans."},
-            {"role": "user", "content": prompt}
-        ]
-        
-        response = await self._make_request(messages, temperature=0.5)
-        
-        # Extract JSON from response
-        try:
-            plan = json.loads(response)
-        except json.JSONDecodeError:
-            if "```json" in response:
-                json_str = response.split("```json")[1].split("```")[0].strip()
-                plan = json.loads(json_str)
-            elif "```" in response:
-                json_str = response.split("```")[1].split("```")[0].strip()
-                plan = json.loads(json_str)
-                raise ValueError("Could not parse JSON from Grok response")
-        
-        return plan
-    
-    async def generate_reasoning(
-        self,
-        expectation_context: str,
-        item_type: str,
-        item_title: str,
-        item_description: str
-    ) -> str:
-        """Generate a short reason for why this item was assigned based on expectations"""
-        prompt = f"""Explain why this {item_type} is relevant for the candidate based on these expectations:
-
-Expectations:
-{expectation_context}
-
-Item: {item_title}
-Description: {item_description}
+_REASONING_INSTRUCTIONS = """Explain why the item in the next message is relevant for the candidate based on the expectations given there.
 
 Provide a ONE SENTENCE reason (under 30 words) starting with "Relevant because..." or "This helps you..."."""
 
-        messages = [
-            {"role": "system", "content": "You are a mentor explaining the 'why' behind a learning plan."},
-            {"role": "user", "content": prompt}
-        ]
-        
-        response = await self._make_request(messages, temperature=0.7, model=self.resume_model)
-        return response.strip()
-
-    async def generate_weekly_reading(
-        self,
-        week_plan: Dict[str, Any],
-        codebase_analysis: Dict[str, Any],
-        expectation_context: str = None
-    ) -> Dict[str, Any]:
-        """Generate AI-powered wiki-style reading material for a week"""
-        reason_prompt = ""
-        if expectation_context:
-            reason_prompt = f"""
-Expectation Context:
-{expectation_context}
-
-Also, add a "reason" field to the JSON explaining why this reading is relevant to the expectation."""
+_REASONING_BATCH_INSTRUCTIONS = """Explain why each item in the next message is relevant for the candidate based on the expectations given there.
 
-        prompt = f"""Create comprehensive reading material for this week of the onboarding plan:
+For each item provide a ONE SENTENCE reason (under 30 words) starting with "Relevant because..." or "This helps you...".
+Return ONLY a JSON array of strings (the reasons), one per item, in the same order as the items."""
 
-Week Plan:
-{json.dumps(week_plan, indent=2)}
+_WEEK_REASON_NOTE = "For the expectation context below, also fill in the \"reason\" field(s) explaining relevance to the expectation."
 
-Codebase Context:
-{json.dumps(codebase_analysis, indent=2)}
-{reason_prompt}
+_WEEKLY_READING_INSTRUCTIONS = """Create comprehensive reading material for the week of the onboarding plan described in the next message.
 
 Generate detailed reading material in JSON format:
-{{
+{
     "title": "Week title",
     "content": "Comprehensive wiki-style content in markdown format covering all topics. Include code examples, diagrams (as ASCII), and explanations. Make it 1500-2000 words.",
     "key_concepts": ["concept1", "concept2", ...],
     "resources": ["resource1 with URL", "resource2 with URL", ...],
-    "reason": "One sentence explaining relevance to the expectation"
-}}
+    "reason": "One sentence explaining relevance to the expectation (only when an expectation context is given)"
+}
 
 IMPORTANT: Return ONLY valid JSON, no markdown code blocks or extra text.
 Make the content educational, engaging, and specific to the codebase."""
 
-        messages = [
-            {"role": "system", "content": "You are an expert technical writer who creates clear, comprehensive documentation for developers. Write engaging educational content. ALWAYS return valid JSON."},
-            {"role": "user", "content": prompt}
-        ]
-        
-        response = await self._make_request(messages, temperature=0.6)
-        
-        # Clean and parse response
-        return self._parse_json_response(response)
-    
-    async def generate_coding_tasks(
-        self,
-        week_plan: Dict[str, Any],
-        codebase_analysis: Dict[str, Any],
-        expectation_context: str = None
-    ) -> List[Dict[str, Any]]:
-        """Generate coding tasks for the week"""
-        reason_prompt = ""
-        if expectation_context:
-            reason_prompt = f"""
-Expectation Context:
-{expectation_context}
-
-For EACH task, add a "reason" field explaining why it is relevant to the expectation."""
-
-        prompt = f"""Create 3-5 coding tasks for this week of the onboarding plan:
-
-Week Plan:
-{json.dumps(week_plan, indent=2)}
-
-Codebase Context:
-{json.dumps(codebase_analysis, indent=2)}
-{reason_prompt}
+_CODING_TASKS_INSTRUCTIONS = """Create 3-5 coding tasks for the week of the onboarding plan described in the next message.
 
 Generate tasks in JSON format:
-{{
+{
     "tasks": [
-        {{
+        {
             "id": "task-1",
             "title": "Task title",
             "description": "Detailed description of what to implement",
@@ -365,11 +328,11 @@ Generate tasks in JSON format:
             "estimated_time": "30 mins - 2 hours",
             "files_to_modify": ["file1.py", "file2.js"],
             "hints": ["hint1", "hint2", ...],
-            "reason": "Relevance to expectation"
-        }},
+            "reason": "Relevance to expectation (only when an expectation context is given)"
+        },
         ...
     ]
-}}
+}
 
 Tasks should:
 - Be practical and related to the actual codebase
@@ -377,60 +340,21 @@ Tasks should:
 - Help reinforce the week's learning objectives
 - Be achievable with the knowledge gained"""
 
-        messages = [
-            {"role": "system", "content": "You are an expert coding instructor who designs hands-on programming exercises. Create practical, educational tasks."},
-            {"role": "user", "content": prompt}
-        ]
-        
-        response = await self._make_request(messages, temperature=0.6)
-        
-        try:
-            result = json.loads(response)
-            return result.get("tasks", [])
-        except json.JSONDecodeError:
-            if "```json" in response:
-                json_str = response.split("```json")[1].split("```")[0].strip()
-                result = json.loads(json_str)
-                return result.get("tasks", [])
-            elif "```" in response:
-                json_str = response.split("```")[1].split("```")[0].strip()
-                result = json.loads(json_str)
-                return result.get("tasks", [])
-            else:
-                try:
-                     # Parse using parse_json_response just in case
-                    result = self._parse_json_response(response)
-                    return result.get("tasks", [])
-                except:
-                     raise ValueError("Could not parse JSON from Grok response")
-    
-    async def generate_quiz(
-        self,
-        week_plan: Dict[str, Any],
-        reading_content: str
-    ) -> List[Dict[str, Any]]:
-        """Generate quiz questions for the week"""
-        prompt = f"""Create a quiz with 8-10 multiple choice questions based on this week's content:
-
-Week Plan:
-{json.dumps(week_plan, indent=2)}
-
-Reading Content (first 1000 chars):
-{reading_content[:1000]}...
+_QUIZ_INSTRUCTIONS = """Create a quiz with 8-10 multiple choice questions based on the week's content in the next message.
 
 Generate quiz in JSON format:
-{{
+{
     "questions": [
-        {{
+        {
             "id": "q1",
             "question": "Question text",
             "options": ["Option A", "Option B", "Option C", "Option D"],
             "correct_answer": 0,
             "explanation": "Why this answer is correct"
-        }},
+        },
         ...
     ]
-}}
+}
 
 Questions should:
 - Test understanding of key concepts
@@ -438,27 +362,409 @@ Questions should:
 - Have clear, unambiguous correct answers
 - Provide helpful explanations"""
 
-        messages = [
-            {"role": "system", "content": "You are an expert educator who creates effective assessments. Design quiz questions that test understanding, not just memorization."},
-            {"role": "user", "content": prompt}
-        ]
+
+def prompt_messages(system: str, instructions: str, context: str) -> List[Dict[str, str]]:
+    """Chat messages with the stable prefix (persona, instructions) ahead of per-call context"""
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": instructions},
+        {"role": "user", "content": context}
+    ]
+
+
+def _week_context(
+    week_plan: Dict[str, Any],
+    codebase_analysis: Union[Dict[str, Any], str],
+    expectation_context: Optional[str]
+) -> str:
+    """Per-week prompt context shared by the reading and coding-task generators.
+    
+    codebase_analysis may be the analysis dict or a prebuilt codebase_context() string.
+    """
+    if not isinstance(codebase_analysis, str):
+        codebase_analysis = codebase_context(codebase_analysis)
+    context = (
+        f"Week Plan:\n{prompt_json(week_plan)}\n\n"
+        f"Codebase Context:\n{codebase_analysis}"
+    )
+    if expectation_context:
+        context += f"\n\nExpectation Context:\n{expectation_context}\n\n{_WEEK_REASON_NOTE}"
+    return context
+
+
+class GrokService:
+    """Service for interacting with Grok API"""
+    
+    def __init__(self):
+        self.api_key = settings.xai_api_key
+        self.base_url = settings.xai_base_url
+        self.model = settings.xai_model
+        self.resume_model = settings.xai_resume_model  # Cheaper model for resume analysis
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Process-wide client: keep-alive + HTTP/2 reuse one TLS connection across calls"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=httpx.Timeout(300.0),
+                limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60),
+                http2=True
+            )
+        return self._client
+    
+    async def aclose(self):
+        """Close the shared client (app shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def _make_request(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        model: str = None,
+        cache: bool = True,
+        stream_json: bool = False,
+        parse: Optional[Callable[[str], Any]] = None
+    ) -> Any:
+        """Make a request to Grok API.
+        
+        Identical requests are answered from the grok_response_cache table; pass
+        cache=False for calls that should always get a fresh completion. With
+        stream_json the completion is streamed and returned as soon as its JSON
+        object closes, for long JSON-only answers.
         
-        response = await self._make_request(messages, temperature=0.5)
+        With parse, the completion is run through it and the result returned
+        instead. A completion is only cached once parse accepts it (a ValueError
+        propagates and nothing is stored), so truncated or malformed answers are
+        never replayed.
+        """
+        model = model or self.model
         
+        cache_key = None
+        if cache and settings.grok_cache_enabled:
+            cache_key = _response_cache_key(model, temperature, messages)
+            try:
+                cached = await _cached_response(cache_key)
+            except Exception as e:
+                cached = None
+                print(f"Warning: Grok response cache lookup failed: {str(e)}")
+            if cached is not None:
+                if parse is None:
+                    return cached
+                try:
+                    return parse(cached)
+                except ValueError:
+                    pass  # Stored before it was validated; fetch a fresh completion
+        
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "stream": stream_json
+        }
+        
+        if stream_json:
+            content = await self._stream_json(payload)
+        else:
+            response = await self._get_client().post("/chat/completions", json=payload)
+            response.raise_for_status()
+            
+            result = response.json()
+            content = result["choices"][0]["message"]["content"]
+        
+        parsed = parse(content) if parse else content
+        
+        if cache_key and content.strip():
+            try:
+                await _store_response(cache_key, content)
+            except Exception as e:
+                print(f"Warning: Grok response cache write failed: {str(e)}")
+        
+        return parsed
+    
+    async def chat(
+        self,
+        system: str,
+        instructions: str,
+        context: str,
+        temperature: float = 0.7,
+        model: str = None,
+        **options
+    ) -> Any:
+        """One Grok completion laid out by prompt_messages(); options go to _make_request"""
+        return await self._make_request(
+            prompt_messages(system, instructions, context),
+            temperature=temperature,
+            model=model,
+            **options
+        )
+    
+    async def _stream_json(self, payload: Dict[str, Any]) -> str:
+        """Accumulate streamed content deltas, stopping once the first JSON object is complete"""
+        parts = []
+        scanner = _JsonSpanScanner()
+        async with self._get_client().stream("POST", "/chat/completions", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                choices = orjson.loads(data).get("choices") or [{}]
+                delta = choices[0].get("delta", {}).get("content")
+                if not delta:
+                    continue
+                parts.append(delta)
+                if scanner.feed(delta) >= 0:
+                    break  # Anything after the object is trailing prose or a closing fence
+        return "".join(parts)
+    
+    def _parse_json_response(self, response: str) -> Any:
+        """Parse the JSON object/array in a Grok response (bare, fenced, or surrounded by prose)"""
+        stripped = response.strip()
+        if stripped[:1] in ("{", "["):
+            try:
+                return orjson.loads(stripped)
+            except orjson.JSONDecodeError:
+                pass
+        
+        # Limit the scan to the first markdown code block, if any
+        start, end = 0, len(response)
+        fence = response.find("```json")
+        if fence < 0:
+            fence = response.find("```")
+        if fence >= 0:
+            start = fence + 3
+            close = response.find("```", start)
+            if close >= 0:
+                end = close
+        
+        first, last = _extract_json_span(response, start, end)
+        if first < 0:
+            raise ValueError(f"Could not parse JSON from response: {response[:200]}")
+        json_str = response[first:last]
+        
+        try:
+            return orjson.loads(json_str)
+        except orjson.JSONDecodeError:
+            # Last resort: raw newlines inside strings are the usual culprit
+            return orjson.loads(json_str.replace("\n", " ").replace("\r", ""))
+    
+    def _parse_model(self, response: str, model: Type[BaseModel]) -> Dict[str, Any]:
+        """Parse a JSON response and validate it against a schema model, returned as a plain dict.
+        
+        Bare JSON is parsed and validated in one pass by pydantic-core; anything else
+        goes through _parse_json_response first. Raises ValueError on a malformed shape.
+        """
+        if response.lstrip()[:1] == "{":
+            try:
+                return model.model_validate_json(response).model_dump()
+            except ValidationError as e:
+                if not any(error["type"] == "json_invalid" for error in e.errors()):
+                    raise
+        return model.model_validate(self._parse_json_response(response)).model_dump()
+    
+    async def analyze_resume(self, resume_text: str) -> Dict[str, Any]:
+        """Analyze resume to understand candidate background"""
+        # Near-duplicate resumes (minor edits, resubmissions) reuse a stored analysis
+        threshold = settings.resume_similarity_threshold if settings.grok_cache_enabled else math.inf
+        response = None
+        if threshold <= 1:
+            try:
+                response = await _similar_response("resume", resume_text, threshold)
+            except Exception as e:
+                print(f"Warning: Resume similarity lookup failed: {str(e)}")
+        
+        fresh = response is None
+        if fresh:
+            # Use cheaper model for resume analysis
+            analysis = await self.chat(
+                "You are an expert technical recruiter and career advisor. Analyze resumes thoroughly and provide actionable insights.",
+                _RESUME_ANALYSIS_INSTRUCTIONS,
+                f"Resume:\n{resume_text}",
+                temperature=0.3,
+                model=self.resume_model,
+                parse=lambda response: self._parse_model(response, ResumeAnalysis)
+            )
+        else:
+            analysis = self._parse_model(response, ResumeAnalysis)
+        
+        if fresh and threshold <= 1:
+            # Only well-formed analyses are offered to similar resumes
+            try:
+                await _store_similar_response("resume", resume_text, orjson.dumps(analysis).decode())
+            except Exception as e:
+                print(f"Warning: Resume similarity cache write failed: {str(e)}")
+
+        # Generate Ramp Up Expectation based on level
         try:
-            result = json.loads(response)
-            return result.get("questions", [])
-        except json.JSONDecodeError:
-            if "```json" in response:
-                json_str = response.split("```json")[1].split("```")[0].strip()
-                result = json.loads(json_str)
-                return result.get("questions", [])
-            elif "```" in response:
-                json_str = response.split("```")[1].split("```")[0].strip()
-                result = json.loads(json_str)
-                return result.get("questions", [])
+            level = analysis.get("experience_level", "junior").lower()
+            expectation_context = get_expectation_prompt(level)
+            
+            if expectation_context:
+                expectation_text = await self.chat(
+                    "You are a thoughtful engineering manager setting expectations for a new hire.",
+                    _RAMP_UP_INSTRUCTIONS,
+                    f"Onboarding Philosophy:\n{expectation_context}\n\n"
+                    f"Candidate Background: {analysis.get('background')}\n"
+                    f"Experience Level: {level}",
+                    temperature=0.5,
+                    model=self.resume_model
+                )
+                analysis["ramp_up_expectation"] = expectation_text.strip()
             else:
-                raise ValueError("Could not parse JSON from Grok response")
+                print(f"Warning: Expectation prompt file not found: {EXPECTATION_PROMPTS_DIR / expectation_prompt_file(level)}")
+                analysis["ramp_up_expectation"] = "Welcome to the team! We are excited to have you onboard and look forward to seeing your contributions."
+
+        except Exception as e:
+            print(f"Error generating expectation: {e}")
+            analysis["ramp_up_expectation"] = "Welcome to the team! We look forward to your ramp up."
+        
+        return analysis
+    
+    async def analyze_codebase(self, codebase_url: str, github_token: Optional[str] = None) -> Dict[str, Any]:
+        """Analyze codebase structure and dependencies using Grok"""
+        return await self.chat(
+            "You are an expert software architect who specializes in onboarding new team members. Analyze codebases to create effective learning paths.",
+            _CODEBASE_ANALYSIS_INSTRUCTIONS,
+            f"Repository: {codebase_url}",
+            temperature=0.3,
+            parse=self._parse_json_response
+        )
+    
+    async def generate_learning_plan(
+        self, 
+        resume_analysis: Dict[str, Any], 
+        codebase_analysis: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Generate 4-week personalized learning plan"""
+        return await self.chat(
+            "You are an expert technical mentor who designs effective onboarding programs. Create structured, personalized learning plans.",
+            _LEARNING_PLAN_INSTRUCTIONS,
+            f"Candidate Profile:\n{prompt_json(resume_analysis)}\n\n"
+            f"Codebase Analysis:\n{prompt_json(codebase_analysis)}",
+            temperature=0.5,
+            parse=self._parse_json_response
+        )
+    
+    async def generate_reasoning(
+        self,
+        expectation_context: str,
+        item_type: str,
+        item_title: str,
+        item_description: str
+    ) -> str:
+        """Generate a short reason for why this item was assigned based on expectations"""
+        response = await self.chat(
+            "You are a mentor explaining the 'why' behind a learning plan.",
+            _REASONING_INSTRUCTIONS,
+            f"Expectations:\n{expectation_context}\n\n"
+            f"{item_type.capitalize()}: {item_title}\n"
+            f"Description: {item_description}",
+            temperature=0.7,
+            model=self.resume_model
+        )
+        return response.strip()
+
+    async def generate_reasoning_batch(
+        self,
+        expectation_context: str,
+        item_type: str,
+        items: List[Dict[str, str]]
+    ) -> List[str]:
+        """Generate reasons for several items of one type in a single request.
+        
+        Each item has a "title" and "description"; reasons are returned in item order.
+        """
+        if len(items) == 1:
+            return [await self.generate_reasoning(
+                expectation_context, item_type, items[0]["title"], items[0]["description"]
+            )]
+        
+        item_lines = "\n\n".join(
+            f"Item {i}: {item['title']}\nDescription: {item['description']}"
+            for i, item in enumerate(items, 1)
+        )
+        def parse_reasons(response: str) -> List[str]:
+            reasons = self._parse_json_response(response)
+            if not isinstance(reasons, list) or len(reasons) != len(items):
+                raise ValueError(f"Expected {len(items)} reasons, got: {response[:200]}")
+            return [str(reason).strip() for reason in reasons]
+        
+        try:
+            return await self.chat(
+                "You are a mentor explaining the 'why' behind a learning plan.",
+                _REASONING_BATCH_INSTRUCTIONS,
+                f"Expectations:\n{expectation_context}\n\n"
+                f"Explain each {item_type} below ({len(items)} reasons):\n\n{item_lines}",
+                temperature=0.7,
+                model=self.resume_model,
+                parse=parse_reasons
+            )
+        except ValueError:
+            # Malformed batch answer: fall back to one request per item
+            return await asyncio.gather(*[
+                self.generate_reasoning(expectation_context, item_type, item["title"], item["description"])
+                for item in items
+            ])
+
+    async def generate_weekly_reading(
+        self,
+        week_plan: Dict[str, Any],
+        codebase_analysis: Union[Dict[str, Any], str],
+        expectation_context: str = None
+    ) -> Dict[str, Any]:
+        """Generate AI-powered wiki-style reading material for a week"""
+        return await self.chat(
+            "You are an expert technical writer who creates clear, comprehensive documentation for developers. Write engaging educational content. ALWAYS return valid JSON.",
+            _WEEKLY_READING_INSTRUCTIONS,
+            _week_context(week_plan, codebase_analysis, expectation_context),
+            temperature=0.6,
+            stream_json=True,
+            parse=lambda response: self._parse_model(response, WeeklyReadingMaterial)
+        )
+    
+    async def generate_coding_tasks(
+        self,
+        week_plan: Dict[str, Any],
+        codebase_analysis: Union[Dict[str, Any], str],
+        expectation_context: str = None
+    ) -> List[Dict[str, Any]]:
+        """Generate coding tasks for the week"""
+        task_set = await self.chat(
+            "You are an expert coding instructor who designs hands-on programming exercises. Create practical, educational tasks.",
+            _CODING_TASKS_INSTRUCTIONS,
+            _week_context(week_plan, codebase_analysis, expectation_context),
+            temperature=0.6,
+            parse=lambda response: self._parse_model(response, CodingTaskSet)
+        )
+        
+        return task_set["tasks"]
+    
+    async def generate_quiz(
+        self,
+        week_plan: Dict[str, Any],
+        reading_content: str
+    ) -> List[Dict[str, Any]]:
+        """Generate quiz questions for the week"""
+        quiz = await self.chat(
+            "You are an expert educator who creates effective assessments. Design quiz questions that test understanding, not just memorization.",
+            _QUIZ_INSTRUCTIONS,
+            f"Week Plan:\n{prompt_json(week_plan)}\n\n"
+            f"Reading Content (first 1000 chars):\n{reading_content[:1000]}...",
+            temperature=0.5,
+            parse=lambda response: self._parse_model(response, Quiz)
+        )
+        
+        return quiz["questions"]
 
 
 # Singleton instance
@@ -5,14 +5,90 @@ This service handles pre-generation of comprehensive learning plans for codebase
 and quick personalization based on candidate profiles.
 """
 
-import json
-from typing import Dict, Any, Optional
-from datetime import datetime
-from sqlalchemy import select, desc
+import asyncio
+from typing import Dict, Any, Optional, Union
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, desc, update, delete, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+from cachetools import TTLCache
 
-from app.database import MasterPlan, CodebaseAnalysis
-from app.services.grok_service import grok_service
+from app.config import settings
+from app.database import (
+    AsyncSessionLocal, CodebaseAnalysis, MasterPlan, MasterPlanJob, ANALYSIS_COMPLETE, JOB_PENDING, JOB_RUNNING, JOB_DONE, JOB_FAILED
+)
+from app.services.grok_service import grok_service, codebase_context, prompt_json
+from app.services.codebase_analyzer import codebase_analyzer
+
+# Latest master plan per codebase as a plain dict (never a session-bound ORM
+# object). Callers must treat it as read-only; it is dropped on every write.
+_master_plan_cache: TTLCache = TTLCache(maxsize=128, ttl=300)
+
+
+def invalidate_master_plan_cache(codebase_id: Optional[str] = None) -> None:
+    """Forget the cached master plan for one codebase (or all of them)"""
+    if codebase_id is None:
+        _master_plan_cache.clear()
+    else:
+        _master_plan_cache.pop(codebase_id, None)
+
+
+# Static instructions go ahead of the per-call context (see GrokService.chat)
+_MASTER_PLAN_INSTRUCTIONS = """Create a comprehensive 4-week onboarding plan for new hires joining the codebase project analyzed in the next message.
+
+Generate a detailed 4-week curriculum in JSON format:
+{
+    "overview": "Brief overview of the learning journey (2-3 sentences)",
+    "weeks": [
+        {
+            "week_number": 1,
+            "title": "Week 1: Foundations and Setup",
+            "description": "What the new hire will learn this week",
+            "objectives": ["objective1", "objective2", ...],
+            "topics": ["topic1", "topic2", ...],
+            "focus_areas": ["area1", "area2", ...]
+        },
+        ... (for all 4 weeks)
+    ]
+}
+
+The plan should:
+- Week 1: Environment setup, basic concepts, architecture overview
+- Week 2: Core components and data structures
+- Week 3: Advanced features and integrations
+- Week 4: Performance, testing, and best practices
+- Be generic enough to work for most new hires
+- Progressive difficulty from beginner to intermediate
+- Include both theory and hands-on coding
+"""
+
+_PERSONALIZE_INSTRUCTIONS = """Personalize the learning plan in the next message for the candidate described there.
+
+Based on the candidate's experience level, skills, and learning areas, provide:
+
+1. Personalized objectives for each week (adjust difficulty and focus)
+2. Recommended emphasis areas based on their background
+3. Any topics they can skip or accelerate through
+4. Specific focus areas for their knowledge gaps
+
+Return JSON:
+{
+    "personalized_overview": "Brief personalized intro (2 sentences)",
+    "recommendations": ["recommendation1", "recommendation2", ...],
+    "week_adjustments": [
+        {
+            "week_number": 1,
+            "difficulty": "beginner|intermediate|advanced",
+            "emphasis": ["area1", "area2"],
+            "skip_topics": ["topic1"],
+            "additional_focus": ["area1"]
+        },
+        ...
+    ]
+}
+
+Keep it concise - just the key personalizations."""
 
 
 class PlanTemplateService:
@@ -28,54 +104,51 @@ class PlanTemplateService:
         This is done once per codebase and stored for reuse.
         """
         # Get latest codebase analysis
-        result = await db.execute(
-            select(CodebaseAnalysis)
-            .where(CodebaseAnalysis.codebase_id == codebase_id)
-            .order_by(desc(CodebaseAnalysis.analyzed_at))
-            .limit(1)
-        )
-        analysis_record = result.scalar_one_or_none()
+        codebase_analysis = await codebase_analyzer.get_latest_analysis(codebase_id, db)
         
-        if not analysis_record:
+        if not codebase_analysis:
             raise ValueError(f"No codebase analysis found for {codebase_id}")
         
-        codebase_analysis = analysis_record.analysis_data
-        
         # Generate comprehensive 4-week plan
         print(f"🔧 Generating master plan for {codebase_id}...")
         plan_data = await self._generate_comprehensive_plan(codebase_analysis)
         
-        # Generate all weekly content
-        weeks_with_content = []
-        for week in plan_data.get("weeks", []):
-            week_number = week["week_number"]
-            print(f"  📚 Generating content for week {week_number}...")
-            
-            # Generate reading, tasks, and quiz
-            reading = await grok_service.generate_weekly_reading(week, codebase_analysis)
-            tasks = await grok_service.generate_coding_tasks(week, codebase_analysis)
-            quiz = await grok_service.generate_quiz(week, reading.get("content", ""))
-            
-            week_with_content = {
-                **week,
-                "reading_material": reading,
-                "coding_tasks": tasks,
-                "quiz": quiz
-            }
-            weeks_with_content.append(week_with_content)
-        
-        # Create master plan record
-        master_plan_id = f"{codebase_id}_v1"
-        master_plan = MasterPlan(
-            id=master_plan_id,
-            codebase_id=codebase_id,
-            version=1,
-            plan_overview=plan_data.get("overview", ""),
-            weeks_data=weeks_with_content
-        )
+        # Generate all weekly content (weeks in parallel), serializing the codebase context once
+        context = codebase_context(codebase_analysis)
+        weeks_with_content = list(await asyncio.gather(*(
+            self._build_week(week, context) for week in plan_data.get("weeks", [])
+        )))
         
-        db.add(master_plan)
-        await db.commit()
+        # Create master plan record (a new version on every regeneration)
+        for attempt in range(3):
+            result = await db.execute(
+                select(func.max(MasterPlan.version)).where(MasterPlan.codebase_id == codebase_id)
+            )
+            version = (result.scalar() or 0) + 1
+            master_plan_id = f"{codebase_id}_v{version}"
+            db.add(MasterPlan(
+                id=master_plan_id,
+                codebase_id=codebase_id,
+                version=version,
+                plan_overview=plan_data.get("overview", ""),
+                weeks_data=weeks_with_content
+            ))
+            # Keep only the newest few versions; each holds a full copy of the content
+            await db.execute(
+                delete(MasterPlan).where(
+                    MasterPlan.codebase_id == codebase_id,
+                    MasterPlan.version <= version - settings.master_plan_versions_kept
+                )
+            )
+            try:
+                await db.commit()
+                break
+            except IntegrityError:
+                # Another worker saved this version first; take the next number
+                await db.rollback()
+                if attempt == 2:
+                    raise
+        invalidate_master_plan_cache(codebase_id)
         
         print(f"✅ Master plan generated and saved: {master_plan_id}")
         
@@ -85,63 +158,93 @@ class PlanTemplateService:
             "weeks": weeks_with_content
         }
     
+    async def master_plan_outdated(self, codebase_id: str, db: AsyncSession) -> bool:
+        """Whether a completed analysis is newer than the latest master plan (or there is no plan yet)"""
+        result = await db.execute(
+            select(func.max(CodebaseAnalysis.analyzed_at)).where(
+                CodebaseAnalysis.codebase_id == codebase_id,
+                CodebaseAnalysis.status == ANALYSIS_COMPLETE
+            )
+        )
+        analyzed_at = result.scalar()
+        if analyzed_at is None:
+            return False  # Nothing to generate from
+        
+        result = await db.execute(
+            select(func.max(MasterPlan.generated_at)).where(MasterPlan.codebase_id == codebase_id)
+        )
+        generated_at = result.scalar()
+        return generated_at is None or analyzed_at > generated_at
+    
+    async def run_master_plan_job(self, job_id: int, codebase_id: str):
+        """Background worker for a MasterPlanJob; uses its own session, never the request's"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(MasterPlanJob).where(MasterPlanJob.id == job_id).values(status=JOB_RUNNING))
+            await db.commit()
+            
+            try:
+                master_plan = await self.generate_master_plan(codebase_id, db)
+                values = {"status": JOB_DONE, "result_id": master_plan["id"]}
+            except Exception as e:
+                await db.rollback()
+                print(f"❌ Master plan job {job_id} failed: {str(e)}")
+                values = {"status": JOB_FAILED, "error": str(e)}
+            
+            await db.execute(
+                update(MasterPlanJob)
+                .where(MasterPlanJob.id == job_id)
+                .values(finished_at=func.now(), **values)
+            )
+            await db.commit()
+    
+    async def fail_abandoned_jobs(self, codebase_id: str, db: AsyncSession) -> None:
+        """Mark a codebase's pending/running jobs older than the job timeout as failed.
+        
+        Their worker died with the process (restart, deploy, scale-down), so they
+        would otherwise stay active forever and block new generations. Does not commit.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.master_plan_job_timeout)
+        await db.execute(
+            update(MasterPlanJob)
+            .where(
+                MasterPlanJob.codebase_id == codebase_id,
+                MasterPlanJob.status.in_((JOB_PENDING, JOB_RUNNING)),
+                MasterPlanJob.created_at < cutoff
+            )
+            .values(status=JOB_FAILED, error="Abandoned: no result within the job timeout", finished_at=func.now())
+        )
+    
+    async def _build_week(self, week: Dict[str, Any], codebase_analysis: Union[Dict[str, Any], str]) -> Dict[str, Any]:
+        """One week of the master plan with its reading, tasks, and quiz"""
+        print(f"  📚 Generating content for week {week['week_number']}...")
+        
+        # Reading and tasks are independent; the quiz is built from the reading
+        reading, tasks = await asyncio.gather(
+            grok_service.generate_weekly_reading(week, codebase_analysis),
+            grok_service.generate_coding_tasks(week, codebase_analysis)
+        )
+        quiz = await grok_service.generate_quiz(week, reading.get("content", ""))
+        
+        return {
+            **week,
+            "reading_material": reading,
+            "coding_tasks": tasks,
+            "quiz": quiz
+        }
+    
     async def _generate_comprehensive_plan(
         self,
         codebase_analysis: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Generate a generic 4-week plan for a codebase"""
-        prompt = f"""Create a comprehensive 4-week onboarding plan for new hires joining a codebase project.
-
-Codebase Analysis:
-{json.dumps(codebase_analysis, indent=2)}
-
-Generate a detailed 4-week curriculum in JSON format:
-{{
-    "overview": "Brief overview of the learning journey (2-3 sentences)",
-    "weeks": [
-        {{
-            "week_number": 1,
-            "title": "Week 1: Foundations and Setup",
-            "description": "What the new hire will learn this week",
-            "objectives": ["objective1", "objective2", ...],
-            "topics": ["topic1", "topic2", ...],
-            "focus_areas": ["area1", "area2", ...]
-        }},
-        ... (for all 4 weeks)
-    ]
-}}
-
-The plan should:
-- Week 1: Environment setup, basic concepts, architecture overview
-- Week 2: Core components and data structures
-- Week 3: Advanced features and integrations
-- Week 4: Performance, testing, and best practices
-- Be generic enough to work for most new hires
-- Progressive difficulty from beginner to intermediate
-- Include both theory and hands-on coding
-"""
-        
-        messages = [
-            {"role": "system", "content": "You are an expert technical mentor who designs comprehensive onboarding programs. Create structured, detailed learning plans."},
-            {"role": "user", "content": prompt}
-        ]
-        
-        response = await grok_service._make_request(messages, temperature=0.5)
-        
-        # Parse JSON response
-        try:
-            plan = json.loads(response)
-        except json.JSONDecodeError:
-            if "```json" in response:
-                json_str = response.split("```json")[1].split("```")[0].strip()
-                plan = json.loads(json_str)
-            elif "```" in response:
-                json_str = response.split("```")[1].split("```")[0].strip()
-                plan = json.loads(json_str)
-            else:
-                raise ValueError("Could not parse JSON from Grok response")
-        
-        return plan
+        return await grok_service.chat(
+            "You are an expert technical mentor who designs comprehensive onboarding programs. Create structured, detailed learning plans.",
+            _MASTER_PLAN_INSTRUCTIONS,
+            f"Codebase Analysis:\n{prompt_json(codebase_analysis)}",
+            temperature=0.5,
+            stream_json=True,
+            parse=grok_service._parse_json_response
+        )
     
     async def get_master_plan(
         self,
@@ -151,6 +254,7 @@ The plan should:
         """Retrieve the latest master plan for a codebase"""
         result = await db.execute(
             select(MasterPlan)
+            .options(undefer(MasterPlan.weeks_data))
             .where(MasterPlan.codebase_id == codebase_id)
             .order_by(desc(MasterPlan.version))
             .limit(1)
@@ -169,6 +273,40 @@ The plan should:
             "generated_at": master_plan.generated_at.isoformat()
         }
     
+    async def get_master_plan_meta(
+        self,
+        codebase_id: str,
+        db: AsyncSession
+    ) -> Optional[Dict[str, Any]]:
+        """Latest master plan's scalar columns only (weeks_data is never loaded)"""
+        result = await db.execute(
+            select(
+                MasterPlan.id,
+                MasterPlan.version,
+                MasterPlan.plan_overview.label("overview"),
+                MasterPlan.week_count,
+                MasterPlan.generated_at
+            )
+            .where(MasterPlan.codebase_id == codebase_id)
+            .order_by(desc(MasterPlan.version))
+            .limit(1)
+        )
+        row = result.mappings().one_or_none()
+        return dict(row) if row else None
+    
+    async def get_master_plan_cached(
+        self,
+        codebase_id: str,
+        db: AsyncSession
+    ) -> Optional[Dict[str, Any]]:
+        """get_master_plan() behind a short-lived in-process cache (read-only result)"""
+        master_plan = _master_plan_cache.get(codebase_id)
+        if master_plan is None:
+            master_plan = await self.get_master_plan(codebase_id, db)
+            if master_plan is not None:
+                _master_plan_cache[codebase_id] = master_plan
+        return master_plan
+    
     async def personalize_plan(
         self,
         master_plan: Dict[str, Any],
@@ -178,62 +316,22 @@ The plan should:
         Quickly personalize a master plan based on candidate's resume.
         This is much faster than generating a plan from scratch.
         """
-        prompt = f"""Personalize this learning plan for a specific candidate.
-
-Master Plan Overview:
-{master_plan.get('overview', '')}
-
-Candidate Profile:
-{json.dumps(resume_analysis, indent=2)}
-
-Week Titles:
-{json.dumps([{'week': w['week_number'], 'title': w['title']} for w in master_plan.get('weeks', [])], indent=2)}
-
-Based on the candidate's experience level ({resume_analysis.get('experience_level', 'mid')}), skills, and learning areas, provide:
-
-1. Personalized objectives for each week (adjust difficulty and focus)
-2. Recommended emphasis areas based on their background
-3. Any topics they can skip or accelerate through
-4. Specific focus areas for their knowledge gaps
-
-Return JSON:
-{{
-    "personalized_overview": "Brief personalized intro (2 sentences)",
-    "recommendations": ["recommendation1", "recommendation2", ...],
-    "week_adjustments": [
-        {{
-            "week_number": 1,
-            "difficulty": "beginner|intermediate|advanced",
-            "emphasis": ["area1", "area2"],
-            "skip_topics": ["topic1"],
-            "additional_focus": ["area1"]
-        }},
-        ...
-    ]
-}}
-
-Keep it concise - just the key personalizations."""
-        
-        messages = [
-            {"role": "system", "content": "You are an expert mentor who personalizes learning plans. Be concise and focus on meaningful adjustments."},
-            {"role": "user", "content": prompt}
-        ]
-        
-        response = await grok_service._make_request(messages, temperature=0.3, model=grok_service.resume_model)
-        
-        # Parse response
+        week_titles = [{'week': w['week_number'], 'title': w['title']} for w in master_plan.get('weeks', [])]
         try:
-            personalizations = json.loads(response)
-        except json.JSONDecodeError:
-            if "```json" in response:
-                json_str = response.split("```json")[1].split("```")[0].strip()
-                personalizations = json.loads(json_str)
-            elif "```" in response:
-                json_str = response.split("```")[1].split("```")[0].strip()
-                personalizations = json.loads(json_str)
-            else:
-                # If parsing fails, return master plan as-is
-                personalizations = {"personalized_overview": master_plan.get("overview")}
+            personalizations = await grok_service.chat(
+                "You are an expert mentor who personalizes learning plans. Be concise and focus on meaningful adjustments.",
+                _PERSONALIZE_INSTRUCTIONS,
+                f"Master Plan Overview:\n{master_plan.get('overview', '')}\n\n"
+                f"Week Titles:\n{prompt_json(week_titles)}\n\n"
+                f"Candidate Profile:\n{prompt_json(resume_analysis)}\n\n"
+                f"Experience Level: {resume_analysis.get('experience_level', 'mid')}",
+                temperature=0.3,
+                model=grok_service.resume_model,
+                parse=grok_service._parse_json_response
+            )
+        except ValueError:
+            # If parsing fails, return master plan as-is
+            personalizations = {"personalized_overview": master_plan.get("overview")}
         
         # Apply personalizations to master plan
         personalized_weeks = []
@@ -1,18 +1,20 @@
 import asyncio
 from app.database import AsyncSessionLocal, MasterPlan
+from app.services.plan_template_service import plan_template_service
 from sqlalchemy import select
 
 async def check_master_plan():
     async with AsyncSessionLocal() as db:
-        result = await db.execute(select(MasterPlan).where(MasterPlan.codebase_id == 'rocksdb'))
-        plan = result.scalar_one_or_none()
+        plan = await plan_template_service.get_master_plan_meta('rocksdb', db)
         
         if plan:
-            print(f"Master Plan Found: {plan.id}")
-            print(f"Overview: {plan.plan_overview[:100]}...")
-            if plan.weeks_data:
-                print(f"Weeks: {len(plan.weeks_data)}")
-                for w in plan.weeks_data:
+            print(f"Master Plan Found: {plan['id']} (v{plan['version']})")
+            print(f"Overview: {(plan['overview'] or '')[:100]}...")
+            if plan['week_count']:
+                print(f"Weeks: {plan['week_count']}")
+                # Per-week details need the large JSON column; load it for this one plan only
+                result = await db.execute(select(MasterPlan.weeks_data).where(MasterPlan.id == plan['id']))
+                for w in result.scalar_one() or []:
                     print(f"Week {w.get('week_number')}: {w.get('title')}")
                     print(f"  Reading: {bool(w.get('reading_material'))}")
             else:
@@ -1,27 +1,26 @@
 import asyncio
-from app.database import engine, Base
+from app.database import get_engine, Base
 from sqlalchemy import text
 
+# Candidate-owned tables; master plans, codebase analyses and Grok caches are kept
+CANDIDATE_TABLES = {"candidates", "learning_plans", "weekly_content", "progress", "progress_items"}
+
 async def clear_candidate_data():
     print("Starting database cleanup...")
-    async with engine.begin() as conn:
-        # Disable foreign key checks to avoid deletion order issues (SQLite specific)
-        await conn.execute(text("PRAGMA foreign_keys = OFF"))
-        
-        # Tables to clear
-        tables_to_clear = [
-            "progress",
-            "weekly_content",
-            "learning_plans",
-            "candidates"
-        ]
-        
-        for table in tables_to_clear:
-            print(f"Clearing table: {table}")
-            await conn.execute(text(f"DELETE FROM {table}"))
-            
-        # Re-enable foreign keys
-        await conn.execute(text("PRAGMA foreign_keys = ON"))
+    # Children before parents, so foreign keys never need to be disabled
+    tables = [t for t in reversed(Base.metadata.sorted_tables) if t.name in CANDIDATE_TABLES]
+    
+    async with get_engine().begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # One statement, no per-row work; also resets the id sequences
+            names = ", ".join(t.name for t in tables)
+            print(f"Truncating tables: {names}")
+            await conn.execute(text(f"TRUNCATE {names} RESTART IDENTITY"))
+        else:
+            # Single transaction, so SQLite syncs once for all tables
+            for table in tables:
+                print(f"Clearing table: {table.name}")
+                await conn.execute(table.delete())
         
     print("Database cleanup complete. Master plans preserved.")
 
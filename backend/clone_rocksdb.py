@@ -2,9 +2,9 @@ import sys
 import os
 sys.path.append(os.getcwd())
 
-from app.services.file_service import file_service
-
 def clone():
+    from app.services.file_service import file_service  # GitPython is only needed once we actually clone
+    
     print("🚀 Cloning RocksDB for file browsing...")
     # This might take a minute
     success = file_service.ensure_repo_exists(
@@ -1,13 +1,12 @@
 
 import asyncio
 import sys
-import math
-from app.database import get_db, Candidate, Progress, WeeklyContent, LearningPlan
-from sqlalchemy import select, desc
-from app.services.file_service import file_service
+from app.database import AsyncSessionLocal, Candidate, Progress, ProgressItem, WeeklyContent, LearningPlan, PROGRESS_READING, PROGRESS_TASK
+from sqlalchemy import select, desc, and_
+from sqlalchemy.orm import undefer
 
 async def check_progress(candidate_id=1):
-    async for db in get_db():
+    async with AsyncSessionLocal() as db:
         print(f"--- Checking Progress for Candidate {candidate_id} ---")
         
         # Get Candidate
@@ -21,6 +20,7 @@ async def check_progress(candidate_id=1):
 
         # Get Learning Plan
         result = await db.execute(select(LearningPlan)
+                                .options(undefer(LearningPlan.plan_data))
                                 .where(LearningPlan.candidate_id == candidate_id)
                                 .order_by(desc(LearningPlan.created_at))
                                 .limit(1))
@@ -32,25 +32,35 @@ async def check_progress(candidate_id=1):
         weeks = plan.plan_data.get("weeks", [])
         print(f"Total Weeks in Plan: {len(weeks)}")
 
+        # All weeks' content counts and progress in one round trip, then every completed item in another
+        result = await db.execute(
+            select(WeeklyContent, Progress)
+            .outerjoin(Progress, and_(
+                Progress.candidate_id == candidate_id,
+                Progress.week_number == WeeklyContent.week_number
+            ))
+            .where(WeeklyContent.learning_plan_id == plan.id)
+        )
+        by_week = {content.week_number: (content, progress) for content, progress in result.all()}
+        
+        progress_ids = [progress.id for _, progress in by_week.values() if progress]
+        items_by_progress = {}
+        if progress_ids:
+            result = await db.execute(
+                select(ProgressItem.progress_id, ProgressItem.kind, ProgressItem.item_id)
+                .where(ProgressItem.progress_id.in_(progress_ids))
+                .order_by(ProgressItem.id)
+            )
+            for progress_id, kind, item_id in result.all():
+                items_by_progress.setdefault(progress_id, []).append((kind, item_id))
+
         total_percent = 0
         
         for week in weeks:
             week_num = week['week_number']
             print(f"\nWeek {week_num}:")
             
-            # Get Content
-            result = await db.execute(select(WeeklyContent).where(
-                WeeklyContent.learning_plan_id == plan.id, 
-                WeeklyContent.week_number == week_num
-            ))
-            content = result.scalar_one_or_none()
-            
-            # Get Progress
-            result = await db.execute(select(Progress).where(
-                Progress.candidate_id == candidate_id, 
-                Progress.week_number == week_num
-            ))
-            progress = result.scalar_one_or_none()
+            content, progress = by_week.get(week_num, (None, None))
             
             if not content:
                 print("  No WeeklyContent found -> 0%")
@@ -59,27 +69,29 @@ async def check_progress(candidate_id=1):
             if not progress:
                 print("  No Progress record found -> 0%")
                 continue
+            
+            # Completed chapters / tasks
+            items = items_by_progress.get(progress.id, [])
+            reading_completed = [item_id for kind, item_id in items if kind == PROGRESS_READING]
+            tasks_completed = [item_id for kind, item_id in items if kind == PROGRESS_TASK]
                 
             # Reading
-            reading_text = content.reading_material.get("content", "")
-            sections = reading_text.count("## ")
-            # estimated_chapters logic from backend
-            total_chapters = max(1, math.ceil(sections / 2)) if sections > 0 else 1
-            completed_chapters = len(progress.reading_completed) if isinstance(progress.reading_completed, list) else 0
+            total_chapters = content.chapter_count or 1
+            completed_chapters = len(reading_completed)
             
-            print(f"  Reading: Completed {completed_chapters} / {total_chapters} chapters. (Raw list: {progress.reading_completed})")
+            print(f"  Reading: Completed {completed_chapters} / {total_chapters} chapters. (Raw list: {reading_completed})")
             reading_score = min(1.0, completed_chapters / total_chapters)
             
             # Tasks
-            total_tasks = len(content.coding_tasks)
-            completed_tasks = len(progress.tasks_completed) if progress.tasks_completed else 0
-            print(f"  Tasks: Completed {completed_tasks} / {total_tasks} tasks. (Raw list: {progress.tasks_completed})")
+            total_tasks = content.task_count or 0
+            completed_tasks = len(tasks_completed)
+            print(f"  Tasks: Completed {completed_tasks} / {total_tasks} tasks. (Raw list: {tasks_completed})")
             tasks_score = 0
             if total_tasks > 0:
                 tasks_score = min(1.0, completed_tasks / total_tasks)
 
             # Quiz
-            total_quiz = len(content.quiz)
+            total_quiz = content.quiz_max_score or 0
             quiz_score_val = progress.quiz_score or 0
             print(f"  Quiz: Score {quiz_score_val} / {total_quiz} questions.")
             quiz_score = 0
@@ -1,61 +1,73 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import select
 
 from app.config import get_settings
-from app.database import init_db, AsyncSessionLocal, CodebaseConfig
+from app.database import init_db, backfill_weekly_content_counts, dialect_insert, AsyncSessionLocal, CodebaseConfig
 from app.routes import router
 
 settings = get_settings()
 
-# Create FastAPI app
-app = FastAPI(
-    title=settings.app_name,
-    description="AI-powered onboarding platform using Grok - Pre-configured for RocksDB",
-    version="1.0.0"
-)
-
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize database on startup"""
-    # Initialize SQLite database
-    await init_db()
-    print("✓ Database initialized")
-    
-    # Initialize RocksDB as pre-configured codebase
+async def _ensure_rocksdb_config():
+    """Create the pre-configured RocksDB codebase if it isn't there yet"""
     async with AsyncSessionLocal() as db:
-        result = await db.execute(select(CodebaseConfig).where(CodebaseConfig.id == 'rocksdb'))
-        rocksdb_config = result.scalar_one_or_none()
-        
-        if not rocksdb_config:
-            rocksdb_config = CodebaseConfig(
+        # Single round trip, and safe when several workers boot at once
+        insert = dialect_insert(db)
+        result = await db.execute(
+            insert(CodebaseConfig)
+            .values(
                 id='rocksdb',
                 name='RocksDB',
                 repository_url='https://github.com/facebook/rocksdb',
                 github_token=None
             )
-            db.add(rocksdb_config)
-            await db.commit()
+            .on_conflict_do_nothing(index_elements=['id'])
+        )
+        await db.commit()
+        if result.rowcount > 0:
             print("✓ RocksDB codebase configuration initialized")
-    
-    # Start master plan scheduler (runs every hour)
-    from app.scheduler import master_plan_scheduler
-    master_plan_scheduler.start()
-    print("✓ Master plan scheduler started")
 
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Cleanup on shutdown"""
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize the database and scheduler on startup; release them on shutdown"""
+    # Tables must exist before the config bootstrap queries them, so these stay sequential
+    await init_db()
+    print("✓ Database initialized")
+    backfilled = await backfill_weekly_content_counts()
+    if backfilled:
+        print(f"✓ Backfilled counts on {backfilled} weekly content rows")
+    await _ensure_rocksdb_config()
+    
+    # Start master plan scheduler (runs every hour) in one worker per host
     from app.scheduler import master_plan_scheduler
+    if master_plan_scheduler.start():
+        print("✓ Master plan scheduler started")
+    
+    yield
+    
     master_plan_scheduler.shutdown()
-    print("✓ Master plan scheduler stopped")
+    
+    from app.services.grok_service import grok_service
+    await grok_service.aclose()
+
+
+# Create FastAPI app
+app = FastAPI(
+    title=settings.app_name,
+    description="AI-powered onboarding platform using Grok - Pre-configured for RocksDB",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
+)
 
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=settings.cors_origins + ["*"],  # Allow all origins for Cloud Run
+    allow_origins=[*settings.cors_origins, "*"],  # Allow all origins for Cloud Run
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
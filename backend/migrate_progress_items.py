@@ -0,0 +1,68 @@
+"""One-off copy of completed chapters/tasks from the old progress JSON arrays.
+
+Progress.reading_completed / tasks_completed were replaced by progress_items
+rows. create_all never drops columns, so databases created before that change
+still hold the arrays; this copies them over. Safe to re-run (existing items
+are skipped). The old columns are left in place.
+
+Run from backend/: python migrate_progress_items.py
+"""
+import asyncio
+
+import orjson
+from sqlalchemy import inspect, text
+
+from app.database import (
+    init_db, get_engine, dialect_insert, AsyncSessionLocal, ProgressItem, PROGRESS_READING, PROGRESS_TASK
+)
+
+# Old column -> ProgressItem kind
+LEGACY_COLUMNS = {"reading_completed": PROGRESS_READING, "tasks_completed": PROGRESS_TASK}
+
+
+def _as_list(value) -> list:
+    """Old arrays come back as JSON text from raw SQL on some drivers"""
+    if isinstance(value, (str, bytes)):
+        value = orjson.loads(value)
+    return value or []
+
+
+async def migrate():
+    # progress_items must exist before copying into it
+    await init_db()
+
+    async with get_engine().connect() as conn:
+        columns = await conn.run_sync(
+            lambda sync_conn: {c["name"] for c in inspect(sync_conn).get_columns("progress")}
+        )
+    legacy = [name for name in LEGACY_COLUMNS if name in columns]
+    if not legacy:
+        print("✅ progress has no legacy completion columns; nothing to copy.")
+        return
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(text(f"SELECT id, {', '.join(legacy)} FROM progress"))
+        rows = []
+        for progress_id, *values in result.all():
+            for name, value in zip(legacy, values):
+                # Chapters were stored as ints, task ids as strings; item_id is text
+                rows.extend(
+                    {"progress_id": progress_id, "kind": LEGACY_COLUMNS[name], "item_id": str(item)}
+                    for item in _as_list(value)
+                )
+
+        if rows:
+            insert = dialect_insert(db)
+            await db.execute(
+                insert(ProgressItem).on_conflict_do_nothing(
+                    index_elements=["progress_id", "kind", "item_id"]
+                ),
+                rows,
+            )
+            await db.commit()
+
+    print(f"✅ Copied {len(rows)} completed items from {', '.join(legacy)} into progress_items (existing ones skipped).")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
@@ -39,7 +39,7 @@ def migrate():
     
     print(f"⬇️ Cloning RocksDB to {new_dir}...")
     try:
-        Repo.clone_from("https://github.com/facebook/rocksdb", new_dir, depth=1)
+        Repo.clone_from("https://github.com/facebook/rocksdb", new_dir, depth=1, filter="blob:none")
         print("✅ Clone successful.")
     except Exception as e:
         print(f"❌ Clone failed: {e}")
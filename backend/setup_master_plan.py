@@ -1,10 +1,12 @@
 import asyncio
 from app.database import AsyncSessionLocal, CodebaseConfig, CodebaseAnalysis
-from app.services.plan_template_service import plan_template_service
-from app.services.codebase_analyzer import codebase_analyzer
 from sqlalchemy import select
 
 async def setup_rocksdb():
+    # Imported here so importing this module doesn't pull in GitPython and the Grok client
+    from app.services.plan_template_service import plan_template_service
+    from app.services.codebase_analyzer import codebase_analyzer
+    
     print("Checking RocksDB configuration...")
     codebase_url = "https://github.com/facebook/rocksdb"
     codebase_id = codebase_url # ID is same as URL in some places, or just "rocksdb"
@@ -0,0 +1,76 @@
+"""Path validation for the codebase file routes.
+
+Run from backend/: python -m unittest discover -s tests
+"""
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+os.environ.setdefault("XAI_API_KEY", "test")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from fastapi.testclient import TestClient
+
+import main
+from app.services.file_service import file_service
+
+
+class FilePathTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = Path(self.tmp.name)
+        self.storage = root / "storage"
+        repo = self.storage / "demo"
+        (repo / "src").mkdir(parents=True)
+        (repo / "src" / "main.cc").write_text("int main() {}\n")
+        (root / "secret.txt").write_text("outside the repo\n")
+        os.symlink(root / "secret.txt", repo / "escape.txt")
+
+        self._storage_dir = file_service.storage_dir
+        file_service.storage_dir = self.storage
+        self.client = TestClient(main.app)
+
+    def tearDown(self):
+        file_service.storage_dir = self._storage_dir
+        self.tmp.cleanup()
+
+    def get(self, route, path, codebase_id="demo"):
+        return self.client.get(f"/api/codebase/{codebase_id}/{route}", params={"path": path})
+
+    def test_files_inside_the_repo_are_served(self):
+        for route in ("content", "raw"):
+            response = self.get(route, "src/main.cc")
+            self.assertEqual(response.status_code, 200, route)
+            self.assertIn("int main", response.text)
+
+    def test_parent_segments_are_rejected(self):
+        for route in ("content", "raw"):
+            for path in ("../secret.txt", "src/../../secret.txt", "../../../../etc/passwd"):
+                self.assertEqual(self.get(route, path).status_code, 400, (route, path))
+
+    def test_absolute_paths_are_rejected(self):
+        for route in ("content", "raw"):
+            for path in ("/etc/passwd", str(Path(self.tmp.name) / "secret.txt")):
+                self.assertEqual(self.get(route, path).status_code, 400, (route, path))
+
+    def test_symlinks_out_of_the_repo_are_rejected(self):
+        for route in ("content", "raw"):
+            self.assertEqual(self.get(route, "escape.txt").status_code, 400, route)
+
+    def test_codebase_id_cannot_leave_storage(self):
+        # Clients normalize ".." out of the URL path, so check the service directly
+        with self.assertRaises(ValueError):
+            file_service.resolve_file("..", "secret.txt")
+        with self.assertRaises(ValueError):
+            file_service.list_files("..", "")
+
+    def test_directory_listing_is_confined(self):
+        self.assertEqual(self.client.get("/api/codebase/demo/files", params={"path": "src"}).status_code, 200)
+        for path in ("..", "/etc", "src/../.."):
+            response = self.client.get("/api/codebase/demo/files", params={"path": path})
+            self.assertEqual(response.status_code, 400, path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,43 +1,29 @@
-import http.client
 import os
+import sys
+import httpx
 
-def upload_resume():
-    host = "localhost"
-    port = 8000
-    endpoint = "/api/upload-resume"
-    file_path = "/Users/zy/Desktop/GrokOnboarding/backend/Elon Musk - Resume Professional Template.pdf"
-    
+BASE_URL = "http://localhost:8000"
+ENDPOINT = "/api/upload-resume"
+DEFAULT_FILE = "/Users/zy/Desktop/GrokOnboarding/backend/Elon Musk - Resume Professional Template.pdf"
+
+# One keep-alive pool shared by every upload in this process
+client = httpx.Client(base_url=BASE_URL, timeout=30.0)
+
+def upload_resume(file_path=DEFAULT_FILE):
     if not os.path.exists(file_path):
         print(f"Error: File not found at {file_path}")
         return
 
-    boundary = '----WebKitFormBoundary7MA4YWxkTrZu0gW'
-    
+    # httpx streams the file into the multipart body; no in-memory copy of the PDF
     with open(file_path, "rb") as f:
-        file_content = f.read()
-
-    # Construct the body
-    body = (
-        f'--{boundary}\r\n'
-        f'Content-Disposition: form-data; name="file"; filename="resume.pdf"\r\n'
-        f'Content-Type: application/pdf\r\n\r\n'
-    ).encode('utf-8') + file_content + (
-        f'\r\n--{boundary}--\r\n'
-    ).encode('utf-8')
-
-    headers = {
-        'Content-Type': f'multipart/form-data; boundary={boundary}',
-        'Content-Length': str(len(body))
-    }
-
-    conn = http.client.HTTPConnection(host, port)
-    conn.request("POST", endpoint, body, headers)
-    response = conn.getresponse()
+        response = client.post(ENDPOINT, files={"file": ("resume.pdf", f, "application/pdf")})
     
-    print(f"Status: {response.status}")
-    response_data = response.read().decode('utf-8')
-    print(f"Response: {response_data}")
-    conn.close()
+    print(f"Status: {response.status_code}")
+    print(f"Response: {response.text}")
 
 if __name__ == "__main__":
-    upload_resume()
+    try:
+        for path in sys.argv[1:] or [DEFAULT_FILE]:
+            upload_resume(path)
+    finally:
+        client.close()
@@ -1,39 +1,39 @@
-import httpx
 import asyncio
-import os
+import time
 
-from app.config import get_settings
-
-settings = get_settings()
-API_KEY = settings.xai_api_key
-BASE_URL = "https://api.x.ai/v1"
+from app.services.grok_service import grok_service
 
 async def test_grok():
-    print(f"Testing Grok API at {BASE_URL}...")
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
+    print(f"Testing Grok API at {grok_service.base_url}...")
     payload = {
         "model": "grok-4-1-fast-reasoning",
         "messages": [
             {"role": "system", "content": "You are a test assistant."},
             {"role": "user", "content": "Hello, world!"}
         ],
-        "stream": False
+        "stream": True
     }
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{BASE_URL}/chat/completions",
-                headers=headers,
-                json=payload
-            )
+
+    # Same pooled HTTP/2 client (base URL, auth, limits, timeouts) the app uses for Grok
+    client = grok_service._get_client()
+    try:
+        started = time.perf_counter()
+        async with client.stream("POST", "/chat/completions", json=payload) as response:
             print(f"Status: {response.status_code}")
-            print(f"Response: {response.text}")
-        except Exception as e:
-            print(f"Error: {e}")
+            print("Response:")
+            first_chunk_at = None
+            # Echo the SSE stream as it arrives instead of buffering the whole body
+            async for chunk in response.aiter_text():
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter() - started
+                print(chunk, end="", flush=True)
+        print()
+        if first_chunk_at is not None:
+            print(f"First chunk after {first_chunk_at:.2f}s, done after {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        await grok_service.aclose()
 
 if __name__ == "__main__":
     asyncio.run(test_grok())
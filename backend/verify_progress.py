@@ -5,15 +5,14 @@ import os
 # Add current directory to path
 sys.path.append(os.getcwd())
 
-from app.database import get_db, Progress, WeeklyContent, LearningPlan
-from sqlalchemy import select, desc
+from app.database import (
+    AsyncSessionLocal, Progress, ProgressItem, WeeklyContent, LearningPlan, PROGRESS_READING, PROGRESS_TASK
+)
+from sqlalchemy import select, desc, and_
+from sqlalchemy.orm import Load
 
 async def main():
-    # Context manager for get_db
-    db_gen = get_db()
-    session = await db_gen.__anext__()
-    
-    try:
+    async with AsyncSessionLocal() as session:
         candidate_id = 2
         week_num = 1
         
@@ -32,59 +31,65 @@ async def main():
             return
         print(f"Plan ID: {plan.id}")
         
-        # Get Content
+        # Content and progress for the week in one query
         result = await session.execute(
-            select(WeeklyContent).where(
+            select(WeeklyContent, Progress)
+            .options(Load(WeeklyContent).undefer_group("content"))
+            .outerjoin(Progress, and_(
+                Progress.candidate_id == candidate_id,
+                Progress.week_number == WeeklyContent.week_number
+            ))
+            .where(
                 WeeklyContent.learning_plan_id == plan.id,
                 WeeklyContent.week_number == week_num
             ).limit(1)
         )
-        content = result.scalars().first()
+        content, progress = result.first() or (None, None)
         
         if not content:
             print("No content found!")
             return
-            
-        # Get Progress
-        result = await session.execute(
-            select(Progress).where(
-                Progress.candidate_id == candidate_id,
-                Progress.week_number == week_num
-            ).limit(1)
-        )
-        progress = result.scalars().first()
         
         if not progress:
             print("No progress found!")
             return
         
+        # Completed chapters / tasks
+        result = await session.execute(
+            select(ProgressItem.kind, ProgressItem.item_id)
+            .where(ProgressItem.progress_id == progress.id)
+            .order_by(ProgressItem.id)
+        )
+        items = result.all()
+        reading_completed = [item_id for kind, item_id in items if kind == PROGRESS_READING]
+        tasks_completed = [item_id for kind, item_id in items if kind == PROGRESS_TASK]
+        
         # Reading Analysis
         reading_text = content.reading_material.get("content", "")
         sections = reading_text.count("## ")
-        import math
-        total_chapters = max(1, math.ceil(sections / 2)) if sections > 0 else 1
+        total_chapters = content.chapter_count or 1
         
-        completed_chapters = len(progress.reading_completed) if isinstance(progress.reading_completed, list) else 0
+        completed_chapters = len(reading_completed)
         
         print(f"\n--- READING ---")
         print(f"Sections (H2): {sections}")
         print(f"Estimated Chapters: {total_chapters}")
-        print(f"Completed Chapters: {completed_chapters} {progress.reading_completed}")
+        print(f"Completed Chapters: {completed_chapters} {reading_completed}")
         reading_score = min(1.0, completed_chapters / total_chapters)
         print(f"Score: {reading_score:.2f} (x30 = {reading_score*30:.1f})")
         
         # Tasks Analysis
-        total_tasks = len(content.coding_tasks or [])
-        completed_tasks = len(progress.tasks_completed) if progress.tasks_completed else 0
+        total_tasks = content.task_count or 0
+        completed_tasks = len(tasks_completed)
         
         print(f"\n--- TASKS ---")
         print(f"Total Tasks: {total_tasks}")
-        print(f"Completed Tasks: {completed_tasks} {progress.tasks_completed}")
+        print(f"Completed Tasks: {completed_tasks} {tasks_completed}")
         tasks_score = min(1.0, completed_tasks / total_tasks) if total_tasks else 0
         print(f"Score: {tasks_score:.2f} (x40 = {tasks_score*40:.1f})")
         
         # Quiz Analysis
-        total_quiz = len(content.quiz or [])
+        total_quiz = content.quiz_max_score or 0
         quiz_score_val = progress.quiz_score or 0
         
         print(f"\n--- QUIZ ---")
@@ -96,9 +101,6 @@ async def main():
         
         week_percent = (reading_score * 30) + (tasks_score * 40) + (quiz_score * 30)
         print(f"\nTOTAL SCORE: {week_percent}")
-        
-    finally:
-        await session.close()
 
 if __name__ == "__main__":
     asyncio.run(main())